@@ -149,6 +149,47 @@ spotify:
 log:
   log_file_path: "${install_path}/log/now_playing.log"
 
+state:
+  no_music_timeout_minutes: 1
+  weather_refresh_minutes: 60
+  clean_after_images: 20
+
+startup:
+  lazy_init: true
+
+play_history:
+  database_path: "${install_path}/log/play_history.db"
+  batch_size: 20
+  flush_interval_minutes: 15
+  max_buffer_size: 1000
+
+watchdog:
+  enabled: true
+  budgets_seconds:
+    record: 15
+    detect: 10
+    identify: 30
+    weather: 15
+    display: 90
+    clean: 180
+  stall_seconds: 180
+  cooldown_minutes: 10
+
+scheduler:
+  adaptive: true
+  backoff:
+    - after_minutes: 10
+      interval_seconds: 10
+    - after_minutes: 60
+      interval_seconds: 30
+    - after_minutes: 240
+      interval_seconds: 60
+  input_level_trigger_dbfs: -45
+  input_level_probe_seconds: 0.25
+  input_level_probe_interval_seconds: 2
+  dense_after_trigger_seconds: 60
+  metrics_log_interval_minutes: 60
+
 EOF
 echo "✔ Configuration file created at ${install_path}/config/config.yaml."
 
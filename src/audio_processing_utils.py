@@ -2,24 +2,31 @@ import io
 import logging
 
 import numpy as np
-from scipy.signal import resample
-import scipy.io.wavfile as wav
 from logger import Logger
 
 class AudioProcessingUtils:
     _logger: logging.Logger = Logger().get_logger()
 
+    @staticmethod
+    def load_dependencies() -> None:
+        # scipy is imported on first use as it dominates startup time on a Raspberry Pi Zero
+        import scipy.signal  # noqa: F401
+        import scipy.io.wavfile  # noqa: F401
+
     @staticmethod
     def resample(audio: np.ndarray, source_sampling_rate: int, target_sampling_rate: int) -> np.ndarray:
+        from scipy.signal import resample
         try:
-            samples = int(len(audio) * target_sampling_rate / source_sampling_rate)
-            return np.squeeze(resample(audio, samples))
+            # Resamples along the last axis, so several equally long recordings can be resampled in one call
+            samples = int(audio.shape[-1] * target_sampling_rate / source_sampling_rate)
+            return np.squeeze(resample(audio, samples, axis=-1))
         except Exception as e:
             AudioProcessingUtils._logger.error(f"Resampling failed: {e}")
             raise RuntimeError("Resampling failed.") from e
 
     @staticmethod
     def to_wav(audio: np.ndarray, sampling_rate: int) -> io.BytesIO:
+        import scipy.io.wavfile as wav
         try:
             buffer = io.BytesIO()
             wav.write(buffer, sampling_rate, audio)
@@ -0,0 +1,154 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Final, List, Optional
+
+from logger import Logger
+from config import Config
+from state_manager import StateManager, DisplayState
+
+
+@dataclass(frozen=True)
+class BackoffStep:
+    after_minutes: float
+    interval_seconds: float
+
+
+@dataclass
+class PolicyMetrics:
+    cycles: int = 0
+    input_level_triggers: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    worst_detection_latency_seconds: float = 0.0
+
+    @property
+    def average_cpu_utilisation(self) -> float:
+        return self.cpu_seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+
+class DetectionScheduler:
+    DENSE_POLICY: Final[str] = 'dense'
+    DEFAULT_BACKOFF_STEPS: Final[List[dict]] = [
+        {'after_minutes': 10, 'interval_seconds': 10},
+        {'after_minutes': 60, 'interval_seconds': 30},
+        {'after_minutes': 240, 'interval_seconds': 60},
+    ]
+
+    def __init__(self, state_managers: List[StateManager], recording_duration_in_seconds: float,
+                 input_level_probe: Callable[[float], float], keep_alive: Callable[[], None]) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._config: dict = Config().get_config().get('scheduler', {})
+        self._state_managers: List[StateManager] = state_managers
+        self._recording_duration_in_seconds: float = recording_duration_in_seconds
+        self._input_level_probe: Callable[[float], float] = input_level_probe
+        self._keep_alive: Callable[[], None] = keep_alive
+
+        self._adaptive: bool = self._config.get('adaptive', False)
+        self._backoff_steps: List[BackoffStep] = sorted(
+            (BackoffStep(**step) for step in self._config.get('backoff', DetectionScheduler.DEFAULT_BACKOFF_STEPS)),
+            key=lambda step: step.after_minutes
+        )
+        self._input_level_trigger_dbfs: Optional[float] = self._config.get('input_level_trigger_dbfs', -45)
+        self._input_level_probe_seconds: float = self._config.get('input_level_probe_seconds', 0.25)
+        self._input_level_probe_interval_seconds: float = self._config.get('input_level_probe_interval_seconds', 2)
+        self._dense_after_trigger_seconds: float = self._config.get('dense_after_trigger_seconds', 60)
+        self._metrics_log_interval_seconds: float = self._config.get('metrics_log_interval_minutes', 60) * 60
+
+        self._metrics: Dict[str, PolicyMetrics] = {}
+        self._metrics_logged_at: float = time.monotonic()
+        self._dense_until: float = 0.0
+        self._cycle_started_at: Optional[float] = None
+        self._cycle_started_at_cpu: Optional[float] = None
+        self._pending_latency_since: Optional[float] = None
+        self._pending_latency_policy: Optional[str] = None
+
+    def start_cycle(self) -> None:
+        self._cycle_started_at = time.monotonic()
+        self._cycle_started_at_cpu = time.process_time()
+
+    def detection_finished(self) -> None:
+        # Called as soon as music detection is done, before identification and display updates. Music that started
+        # right after the previous recording ended is only noticed now.
+        if self._pending_latency_since is not None:
+            metrics = self._get_metrics(self._pending_latency_policy)
+            latency = time.monotonic() - self._pending_latency_since
+            metrics.worst_detection_latency_seconds = max(metrics.worst_detection_latency_seconds, latency)
+        self._pending_latency_since = self._cycle_started_at + self._recording_duration_in_seconds
+
+    def wait_for_next_cycle(self) -> None:
+        policy, interval_seconds = self._select_policy()
+        triggered = self._wait(interval_seconds)
+        if triggered:
+            self._dense_until = time.monotonic() + self._dense_after_trigger_seconds
+
+        metrics = self._get_metrics(policy)
+        metrics.cycles += 1
+        metrics.input_level_triggers += int(triggered)
+        if self._cycle_started_at is not None:
+            metrics.wall_seconds += time.monotonic() - self._cycle_started_at
+            metrics.cpu_seconds += time.process_time() - self._cycle_started_at_cpu
+        self._pending_latency_policy = policy
+
+        self._log_metrics_periodically()
+
+    def _select_policy(self) -> tuple[str, float]:
+        if not self._adaptive:
+            return DetectionScheduler.DENSE_POLICY, 0.0
+        # One recording covers all rooms, so the most active room decides
+        if (any(state_manager.get_state().current != DisplayState.SCREENSAVER for state_manager in self._state_managers)
+                or time.monotonic() < self._dense_until):
+            return DetectionScheduler.DENSE_POLICY, 0.0
+
+        screensaver_minutes = min(state_manager.get_time_in_screensaver().total_seconds()
+                                  for state_manager in self._state_managers) / 60
+        selected_step = None
+        for step in self._backoff_steps:
+            if screensaver_minutes >= step.after_minutes:
+                selected_step = step
+        if selected_step is None:
+            return DetectionScheduler.DENSE_POLICY, 0.0
+        return f"backoff-{selected_step.after_minutes:g}m", selected_step.interval_seconds
+
+    def _wait(self, interval_seconds: float) -> bool:
+        if interval_seconds <= 0:
+            return False
+
+        deadline = time.monotonic() + interval_seconds
+        while True:
+            self._keep_alive()  # Waiting counts as progress, a backoff interval may exceed the watchdog stall time
+            if self._input_level_trigger_dbfs is not None and self._input_level_triggered():
+                return True
+
+            remaining_seconds = deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                return False
+            time.sleep(min(self._input_level_probe_interval_seconds, remaining_seconds))
+
+    def _input_level_triggered(self) -> bool:
+        try:
+            input_level = self._input_level_probe(self._input_level_probe_seconds)
+        except Exception as e:
+            self._logger.error(f"Input level probe failed: {e}")
+            return False
+        if input_level >= self._input_level_trigger_dbfs:
+            self._logger.debug(f"Input level of {input_level:.1f} dBFS, resuming dense sampling.")
+            return True
+        return False
+
+    def _get_metrics(self, policy: str) -> PolicyMetrics:
+        if policy not in self._metrics:
+            self._metrics[policy] = PolicyMetrics()
+        return self._metrics[policy]
+
+    def _log_metrics_periodically(self) -> None:
+        if time.monotonic() - self._metrics_logged_at < self._metrics_log_interval_seconds:
+            return
+        self._metrics_logged_at = time.monotonic()
+        for policy, metrics in self._metrics.items():
+            self._logger.info(
+                f"Scheduler policy {policy}: {metrics.cycles} cycles, "
+                f"{metrics.input_level_triggers} input level triggers, "
+                f"average CPU utilisation {metrics.average_cpu_utilisation:.0%}, "
+                f"worst-case detection latency {metrics.worst_detection_latency_seconds:.1f}s."
+            )
@@ -0,0 +1,53 @@
+import datetime
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from logger import Logger
+
+
+@dataclass(frozen=True)
+class DetectionTraceEvent:
+    timestamp: datetime.datetime
+    music_detected: bool
+    song_title: Optional[str] = None
+    song_artist: Optional[str] = None
+    room: Optional[str] = None
+
+
+# Detection/identification results, one JSON object per line, that can be replayed by the simulator
+class DetectionTrace:
+    def __init__(self, trace_file_path: str) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._trace_file_path: str = trace_file_path
+
+    def append(self, event: DetectionTraceEvent) -> None:
+        try:
+            with open(self._trace_file_path, 'a') as trace_file:
+                trace_file.write(json.dumps({
+                    'timestamp': event.timestamp.isoformat(),
+                    'music_detected': event.music_detected,
+                    'song_title': event.song_title,
+                    'song_artist': event.song_artist,
+                    'room': event.room
+                }) + '\n')
+        except OSError as e:
+            self._logger.error(f"Writing detection trace failed: {e}")
+
+    @staticmethod
+    def load(trace_file_path: str) -> List[DetectionTraceEvent]:
+        events = []
+        with open(trace_file_path, 'r') as trace_file:
+            for line in trace_file:
+                if not line.strip():
+                    continue
+                raw_event = json.loads(line)
+                events.append(DetectionTraceEvent(
+                    timestamp=datetime.datetime.fromisoformat(raw_event['timestamp']),
+                    music_detected=raw_event['music_detected'],
+                    song_title=raw_event.get('song_title'),
+                    song_artist=raw_event.get('song_artist'),
+                    room=raw_event.get('room')
+                ))
+        return sorted(events, key=lambda event: event.timestamp)
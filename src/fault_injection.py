@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, ClassVar, List
+
+from logger import Logger
+
+
+class InjectedFaultError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Fault:
+    DELAY: ClassVar[str] = 'delay'
+    HANG: ClassVar[str] = 'hang'
+    RAISE: ClassVar[str] = 'raise'
+
+    service: str
+    method: str
+    mode: str
+    seconds: float = 0.0
+    after_calls: int = 0  # Number of calls that succeed before the fault kicks in
+
+    @staticmethod
+    def parse(spec: str) -> 'Fault':
+        # <service>.<method>:<mode>[:<seconds>[:<after_calls>]], e.g. SongIdentifyService.identify:delay:45 or
+        # DisplayService[kitchen].update_display_to_playing:hang
+        target, _, options = spec.partition(':')
+        service, _, method = target.rpartition('.')
+        mode, *arguments = options.split(':')
+        if not service or not method or mode not in (Fault.DELAY, Fault.HANG, Fault.RAISE):
+            raise ValueError(f"Invalid fault '{spec}', expected <service>.<method>:delay|hang|raise"
+                             f"[:<seconds>[:<after_calls>]].")
+        return Fault(service, method, mode,
+                     seconds=float(arguments[0]) if len(arguments) > 0 else 0.0,
+                     after_calls=int(arguments[1]) if len(arguments) > 1 else 0)
+
+    def applies_to(self, service_name: str) -> bool:
+        # DisplayService applies to the display of every room, DisplayService[kitchen] to a single one
+        return service_name == self.service or service_name.startswith(f"{self.service}[")
+
+    def inject(self) -> None:
+        if self.mode == Fault.DELAY:
+            time.sleep(self.seconds)
+        elif self.mode == Fault.HANG:
+            threading.Event().wait()
+        else:
+            raise InjectedFaultError(f"Injected fault in {self.service}.{self.method}.")
+
+
+# Stand-in for a service that forwards every call to it, but delays, hangs or fails the calls of the given methods,
+# e.g. to check how the pipeline watchdog handles a stalled Shazam request or a wedged display
+class FaultInjectingService:
+    def __init__(self, service: Any, faults: List[Fault]) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._service: Any = service
+        self._faults: List[Fault] = faults
+        self._calls: Counter = Counter()
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._service, name)
+        faults = [fault for fault in self._faults if fault.method == name]
+        if not faults or not callable(attribute):
+            return attribute
+        return self._with_faults(name, attribute, faults)
+
+    def _with_faults(self, name: str, method: Callable, faults: List[Fault]) -> Callable:
+        def faulty_method(*args, **kwargs):
+            self._calls[name] += 1
+            for fault in faults:
+                if self._calls[name] > fault.after_calls:
+                    self._logger.warning(f"Injecting {fault.mode} fault in {fault.service}.{name}.")
+                    fault.inject()
+            return method(*args, **kwargs)
+
+        return faulty_method
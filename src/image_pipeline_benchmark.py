@@ -0,0 +1,68 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import Config
+from service.display_service import DisplayService
+
+# Compares the previous image pipeline (full decode, ImageOps.fit, a second LANCZOS pass for the small album cover)
+# with the one DisplayService runs now (JPEG draft decode, a single resampling pass per output), both in speed and in
+# how much the rendered frames differ
+
+TITLE: str = "Get Lucky"
+SUBTITLE: str = "Daft Punk"
+
+
+def _legacy_render(display_service: DisplayService, image_path: str) -> Image:
+    config = Config().get_config()['display']
+    display_size = (config['width'], config['height'])
+    cover_px = config['small_album_cover_px']
+    image = ImageOps.fit(Image.open(image_path), display_size, centering=(0, 0))
+    cover = image.resize((cover_px, cover_px), Image.LANCZOS)
+    image.paste(cover, ((display_size[0] - cover_px) // 2, config['offset_top_px']))
+    display_service._add_text(image, TITLE, SUBTITLE)
+    return image
+
+
+def _render(display_service: DisplayService, image_path: str) -> Image:
+    return display_service._generate_display_image(Image.open(image_path), TITLE, SUBTITLE, True)
+
+
+def _time(function: Callable[[], Image], iterations: int) -> Tuple[float, Image]:
+    result = function()  # Warm-up, e.g. to load the fonts
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        result = function()
+    return (time.perf_counter() - started_at) / iterations, result
+
+
+def run(image_paths: List[str], iterations: int) -> None:
+    # Rendered frames are only compared, never shown, so no Inky display is needed
+    display_service = DisplayService(output_path=os.path.join(tempfile.gettempdir(), 'image_pipeline_benchmark.png'))
+
+    for image_path in image_paths:
+        legacy_render_seconds, legacy_image = _time(lambda: _legacy_render(display_service, image_path), iterations)
+        render_seconds, image = _time(lambda: _render(display_service, image_path), iterations)
+
+        render_difference = float(np.abs(np.asarray(legacy_image.convert('RGB'), dtype=np.float32)
+                                         - np.asarray(image.convert('RGB'), dtype=np.float32)).mean())
+        source_width, source_height = Image.open(image_path).size
+        print(f"{os.path.basename(image_path)} ({source_width}x{source_height} -> {image.width}x{image.height}, "
+              f"{iterations} iterations)")
+        print(f"  render: {legacy_render_seconds * 1000:7.1f} ms -> {render_seconds * 1000:7.1f} ms, "
+              f"mean absolute difference {render_difference:.2f}/255")
+
+
+if __name__ == "__main__":
+    default_image_path = os.path.join(os.path.dirname(__file__), '..', 'resources', 'default.jpg')
+    parser = argparse.ArgumentParser(description="Benchmarks the album art rendering pipeline.")
+    parser.add_argument('images', nargs='*', default=[default_image_path], help="JPEG or PNG images to render")
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    run(args.images, args.iterations)
@@ -0,0 +1,56 @@
+import logging
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+from logger import Logger
+
+T = TypeVar('T')
+
+
+# Constructs a service on first use, or ahead of time in a background thread via preload()
+class LazyService(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], T]) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._name: str = name
+        self._factory: Callable[[], T] = factory
+        self._instance: Optional[T] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._preload_thread: Optional[threading.Thread] = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def is_initialised(self) -> bool:
+        return self._instance is not None
+
+    def preload(self) -> None:
+        if self._instance is not None or self._preload_thread is not None:
+            return
+
+        def load():
+            try:
+                self.get()
+            except Exception as e:
+                self._logger.error(f"Background initialisation of {self._name} failed: {e}")
+
+        self._logger.debug(f"Initialising {self._name} in the background.")
+        self._preload_thread = threading.Thread(target=load, name=f"preload-{self._name}", daemon=True)
+        self._preload_thread.start()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> None:
+        if self._preload_thread is not None:
+            self._preload_thread.join(timeout)
+
+    def get(self) -> T:
+        if self._instance is not None:
+            return self._instance
+
+        with self._lock:
+            if self._instance is None:
+                try:
+                    self._instance = self._factory()
+                    self._logger.debug(f"{self._name} initialised.")
+                except Exception as e:
+                    raise RuntimeError(f"Initialisation of {self._name} failed.") from e
+            return self._instance
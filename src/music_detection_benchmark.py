@@ -0,0 +1,67 @@
+import argparse
+import logging
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from logger import Logger
+from audio_processing_utils import AudioProcessingUtils
+from service.music_detection_service import MusicDetectionService
+
+# Compares classifying the recordings of several rooms with one interpreter invocation per room against a single
+# batched invocation for all rooms, in CPU time and YAMNet patches scored per room as the number of rooms grows. Rooms
+# are fed from WAV files, like the wav:<path> virtual inputs.
+
+
+def _load_wav(wav_file_path: str, duration_in_seconds: float) -> np.ndarray:
+    import scipy.io.wavfile as wav
+
+    source_sampling_rate, audio = wav.read(wav_file_path)
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio.astype(np.float32) / np.iinfo(audio.dtype).max
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if source_sampling_rate != MusicDetectionService.SAMPLING_RATE:
+        audio = AudioProcessingUtils.resample(audio, source_sampling_rate, MusicDetectionService.SAMPLING_RATE)
+    frames = int(duration_in_seconds * MusicDetectionService.SAMPLING_RATE)
+    return np.resize(audio.astype(np.float32), frames)  # Loops short files, like a WAV input does
+
+
+def _cpu_time(function: Callable[[], List[bool]], iterations: int) -> float:
+    function()  # Warm-up, e.g. to resize the input tensor
+    started_at = time.process_time()
+    for _ in range(iterations):
+        function()
+    return (time.process_time() - started_at) / iterations
+
+
+def run(wav_file_paths: List[str], max_rooms: int, iterations: int, duration_in_seconds: int) -> None:
+    service = MusicDetectionService(audio_duration_in_seconds=duration_in_seconds)
+    recordings = [_load_wav(wav_file_path, duration_in_seconds) for wav_file_path in wav_file_paths]
+
+    for rooms in range(1, max_rooms + 1):
+        waveforms = [recordings[i % len(recordings)] for i in range(rooms)]
+        per_room_seconds = _cpu_time(lambda: [service.is_music_detected(waveform) for waveform in waveforms],
+                                     iterations)
+        batched_seconds = _cpu_time(lambda: service.are_music_detected(waveforms), iterations)
+        per_room_patches = sum(MusicDetectionService.count_patches(len(waveform)) for waveform in waveforms)
+        batched_patches = MusicDetectionService.count_patches(sum(len(waveform) for waveform in waveforms))
+        same_decisions = ([service.is_music_detected(waveform) for waveform in waveforms]
+                          == service.are_music_detected(waveforms))
+        print(f"{rooms} room(s): per-room invocations {per_room_seconds / rooms * 1000:6.1f} ms/room "
+              f"({per_room_patches / rooms:4.1f} patches/room), batched {batched_seconds / rooms * 1000:6.1f} ms/room "
+              f"({batched_patches / rooms:4.1f} patches/room), batched is {per_room_seconds / batched_seconds:.2f}x "
+              f"as fast, same decisions: {'yes' if same_decisions else 'no'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks batched music detection for multiple rooms.")
+    parser.add_argument('wav_files', nargs='+', help="WAV files to use as room inputs, reused if there are more rooms")
+    parser.add_argument('--rooms', type=int, default=4, help="benchmark 1 up to this many rooms")
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--duration', type=int, default=5, help="recording duration per room in seconds")
+    args = parser.parse_args()
+
+    Logger().get_logger().setLevel(logging.WARNING)  # Every detection is logged otherwise
+    run(args.wav_files, args.rooms, args.iterations, args.duration)
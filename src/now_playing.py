@@ -1,139 +1,340 @@
-import logging
 import sys
+from startup_profiler import StartupProfiler
+
+# Installed before any other import so that the startup profile covers those as well
+_startup_profiler = StartupProfiler() if '--profile-startup' in sys.argv else None
+if _startup_profiler:
+    _startup_profiler.install()
+
+import argparse
+import io
+import logging
 import numpy as np
 import traceback
 import signal
-from typing import Tuple, Final
-import gpiod
-import gpiodevice
-from gpiod.line import Bias, Direction, Edge
+from typing import Dict, List, Tuple, Final, Optional, Callable, TypeVar, TYPE_CHECKING
 import threading
 
 from logger import Logger
 from config import Config
-from state_manager import StateManager, DisplayState
-
-from service.song_identify_service import SongIdentifyService, SongInfo
+from state_manager import StateManager, StatePolicy, DisplayState
+from room_controller import RoomController
+from lazy_service import LazyService
+from detection_scheduler import DetectionScheduler
+from detection_trace import DetectionTrace
+from room import Room
+from sampling_profiler import SamplingProfiler
+from play_history import PlayHistory
+from pipeline_watchdog import PipelineWatchdog, StageBusyError, StageTimeoutError
+from systemd_notifier import SystemdNotifier
+from fault_injection import Fault, FaultInjectingService
 from audio_processing_utils import AudioProcessingUtils
-from service.audio_recording_service import AudioRecordingService
-from service.music_detection_service import MusicDetectionService
-from service.weather_service import WeatherService, WeatherInfo
-from service.display_service import DisplayService
-from service.spotify_service import SpotifyService
+
+# Services are imported when they are constructed, as their dependencies (scipy, tflite_runtime, shazamio, spotipy,
+# PIL, inky) dominate startup time
+if TYPE_CHECKING:
+    from service.song_identify_service import SongIdentifyService
+    from service.audio_recording_service import AudioRecordingService
+    from service.music_detection_service import MusicDetectionService
+    from service.weather_service import WeatherService
+    from service.display_service import DisplayService
+    from service.spotify_service import SpotifyService
+
+T = TypeVar('T')
 
 
 class NowPlaying:
     AUDIO_DEVICE_SAMPLING_RATE: Final[int] = 44100
     AUDIO_DEVICE_NUMBER_OF_CHANNELS: Final[int] = 1
     AUDIO_RECORDING_DURATION_IN_SECONDS: Final[int] = 5
+    AUDIO_ABORT_TIMEOUT_IN_SECONDS: Final[int] = 5
     SUPPORTED_SAMPLING_RATE_BY_MUSIC_DETECTION_MODEL: Final[int] = 16000
 
     BUTTONS = [5, 6, 16, 24]
     LABELS = ["A", "B", "C", "D"]
-    INPUT = gpiod.LineSettings(direction=Direction.INPUT, bias=Bias.PULL_UP, edge_detection=Edge.FALLING)
 
-    def __init__(self) -> None:
+    def __init__(self, startup_profiler: Optional[StartupProfiler] = None,
+                 faults: Optional[List[Fault]] = None) -> None:
         signal.signal(signal.SIGTERM, self._handle_exit)  # System or process termination
         signal.signal(signal.SIGINT, self._handle_exit)  # Ctrl+C termination
+        signal.signal(signal.SIGUSR1, self._handle_profiler_toggle)  # Start/stop the sampling profiler
 
         self._config: dict = Config().get_config()
         self._logger: logging.Logger = Logger().get_logger()
+        self._startup_profiler: Optional[StartupProfiler] = startup_profiler
+        self._sampling_profiler: SamplingProfiler = SamplingProfiler(tag_provider=self._describe_display_states)
+        self._faults: List[Fault] = faults or []
+        # Started first, so that a startup that hangs is restarted as well
+        self._watchdog: PipelineWatchdog = PipelineWatchdog(SystemdNotifier(), shutdown_hook=self._shutdown)
+        self._watchdog.start()
 
-        self._audio_recording_service: AudioRecordingService = AudioRecordingService(
-            sampling_rate=NowPlaying.AUDIO_DEVICE_SAMPLING_RATE,
-            channels=NowPlaying.AUDIO_DEVICE_NUMBER_OF_CHANNELS
+        self._audio_recording_service: LazyService['AudioRecordingService'] = self._lazy_service(
+            'AudioRecordingService', self._create_audio_recording_service)
+        self._music_detection_service: LazyService['MusicDetectionService'] = self._lazy_service(
+            'MusicDetectionService', self._create_music_detection_service)
+        self._song_identify_service: LazyService['SongIdentifyService'] = self._lazy_service(
+            'SongIdentifyService', self._create_song_identify_service)
+        self._weather_service: LazyService['WeatherService'] = self._lazy_service(
+            'WeatherService', self._create_weather_service)
+        self._spotify_service: LazyService['SpotifyService'] = self._lazy_service(
+            'SpotifyService', self._create_spotify_service)
+        self._rooms: List[Room] = self._create_rooms()
+        self._detection_scheduler: DetectionScheduler = DetectionScheduler(
+            [room.state_manager for room in self._rooms],
+            recording_duration_in_seconds=NowPlaying.AUDIO_RECORDING_DURATION_IN_SECONDS,
+            input_level_probe=self._measure_input_level,
+            keep_alive=self._watchdog.kick
         )
-        self._music_detection_service: MusicDetectionService = MusicDetectionService(
-            audio_duration_in_seconds=NowPlaying.AUDIO_RECORDING_DURATION_IN_SECONDS
+        trace_file_path = self._config.get('trace', {}).get('trace_file_path')
+        self._detection_trace: Optional[DetectionTrace] = DetectionTrace(trace_file_path) if trace_file_path else None
+        self._play_history: Optional[PlayHistory] = PlayHistory.from_config(self._config)
+        self._room_controller: RoomController = RoomController(
+            song_identify_service=self._song_identify_service,
+            weather_service=self._weather_service,
+            detection_trace=self._detection_trace,
+            play_history=self._play_history,
+            watchdog=self._watchdog
         )
-        self._song_identify_service: SongIdentifyService = SongIdentifyService()
-        self._weather_service: WeatherService = WeatherService()
-        self._display_service: DisplayService = DisplayService()
-        self._spotify_service: SpotifyService = SpotifyService()
-        self._state_manager: StateManager = StateManager()
 
-        self._clean_display_and_set_clean_state()
-        self._setup_buttons()
-        self._start_button_listener()
+        if self._config.get('startup', {}).get('lazy_init', False):
+            # The model loads while the display is cleaned and the first recording is made. The remaining services
+            # are constructed on first use, Spotify only on the first button press.
+            self._music_detection_service.preload()
+            if self._startup_profiler:
+                for service in (self._song_identify_service, self._weather_service, self._spotify_service):
+                    self._startup_profiler.mark_deferred(service.name)
+        else:
+            for service in (self._audio_recording_service, self._music_detection_service,
+                            self._song_identify_service, self._weather_service, self._spotify_service):
+                service.get()
+            for room in self._rooms:
+                room.display_service.get()
+
+        for room in self._rooms:
+            self._room_controller.clean_display_and_set_clean_state(room)
+
+        # The buttons are part of the Inky display
+        self._button_room: Optional[Room] = next((room for room in self._rooms if room.has_inky_display()), None)
+        if self._button_room:
+            self._setup_buttons()
+            self._start_button_listener()
+
+        self._watchdog.ready()
 
     def run(self) -> None:
         while True:
+            self._watchdog.kick()
+            self._detection_scheduler.start_cycle()
             try:
-                audio, is_music_detected = self._record_audio_and_detect_music()
-                if is_music_detected:
-                    self._handle_music_detected(audio)
-                else:
-                    self._handle_no_music_detected()
+                audio_per_room, music_detected_per_room = self._record_audio_and_detect_music()
+                self._detection_scheduler.detection_finished()
+                for room in self._rooms:
+                    try:
+                        # Rooms without a microphone are reported as silent
+                        if music_detected_per_room.get(room.name, False):
+                            self._room_controller.handle_music_detected(room, self._to_wav(audio_per_room[room.name]))
+                        else:
+                            self._room_controller.handle_no_music_detected(room)
+                    except StageBusyError:
+                        pass  # Logged once by the watchdog
+                    except Exception as e:
+                        self._logger.error(f"Error occurred in room '{room.name}': {e}")
+                        self._logger.error(traceback.format_exc())
 
+            except StageBusyError as e:
+                # Retrying right away would spin, so the cycle waits for the stuck call and starts over
+                self._watchdog.wait_until_free(e.resource)
+                continue
             except Exception as e:
                 self._logger.error(f"Error occurred: {e}")
                 self._logger.error(traceback.format_exc())
 
-    def _record_audio_and_detect_music(self) -> Tuple[np.ndarray, bool]:
-        audio = self._audio_recording_service.record(
-            duration=NowPlaying.AUDIO_RECORDING_DURATION_IN_SECONDS
+            if self._play_history:
+                self._play_history.flush_if_due()
+            self._report_startup_profile()
+            self._detection_scheduler.wait_for_next_cycle()
+
+    def _lazy_service(self, name: str, factory: Callable[[], T]) -> LazyService[T]:
+        faults = [fault for fault in self._faults if fault.applies_to(name)]
+        if faults:
+            self._logger.warning(f"Injecting faults in {name}: {faults}")
+            factory = lambda factory=factory: FaultInjectingService(factory(), faults)
+
+        if not self._startup_profiler:
+            return LazyService(name, factory)
+
+        def profiled_factory() -> T:
+            with self._startup_profiler.measure_init(name):
+                return factory()
+
+        return LazyService(name, profiled_factory)
+
+    def _create_rooms(self) -> List[Room]:
+        # Without a rooms section, there is a single room with the first USB microphone and the Inky display
+        rooms_config = self._config.get('rooms') or [{'name': 'default'}]
+        state_policy = StatePolicy.from_config(self._config)
+        rooms = []
+        for room_config in rooms_config:
+            display = room_config.get('display', Room.INKY_DISPLAY)
+            rooms.append(Room(
+                name=room_config['name'],
+                input_device=room_config.get('input_device', 'usb'),
+                display=display,
+                state_manager=StateManager(state_policy),
+                display_service=self._lazy_service(f"DisplayService[{room_config['name']}]",
+                                                   lambda display=display: NowPlaying._create_display_service(display))
+            ))
+        if len({room.name for room in rooms}) != len(rooms):
+            raise ValueError("Room names must be unique.")
+        if sum(room.has_inky_display() for room in rooms) > 1:
+            raise ValueError("Only one room can use the Inky display.")
+        return rooms
+
+    def _create_audio_recording_service(self) -> 'AudioRecordingService':
+        from service.audio_recording_service import AudioRecordingService
+        return AudioRecordingService(
+            sampling_rate=NowPlaying.AUDIO_DEVICE_SAMPLING_RATE,
+            channels=NowPlaying.AUDIO_DEVICE_NUMBER_OF_CHANNELS,
+            input_devices={room.name: room.input_device for room in self._rooms}
         )
-        resampled_audio = AudioProcessingUtils.resample(
-            audio,
-            source_sampling_rate=NowPlaying.AUDIO_DEVICE_SAMPLING_RATE,
-            target_sampling_rate=NowPlaying.SUPPORTED_SAMPLING_RATE_BY_MUSIC_DETECTION_MODEL
+
+    @staticmethod
+    def _create_music_detection_service() -> 'MusicDetectionService':
+        from service.music_detection_service import MusicDetectionService
+        AudioProcessingUtils.load_dependencies()  # Resampling runs right before every inference
+        return MusicDetectionService(
+            audio_duration_in_seconds=NowPlaying.AUDIO_RECORDING_DURATION_IN_SECONDS
         )
-        is_music_detected = self._music_detection_service.is_music_detected(resampled_audio)
-        return audio, is_music_detected
 
-    def _handle_music_detected(self, audio: np.ndarray) -> None:
-        song_info = self._trigger_song_identify(audio)
-        if (
-                song_info
-                and (self._state_manager.get_state().current != DisplayState.PLAYING
-                     or self._state_manager.music_still_playing_but_different_song_identified(song_info.title))
-        ):
-            self._set_playing_state_and_update_display(song_info)
+    @staticmethod
+    def _create_song_identify_service() -> 'SongIdentifyService':
+        from service.song_identify_service import SongIdentifyService
+        return SongIdentifyService()
+
+    @staticmethod
+    def _create_weather_service() -> 'WeatherService':
+        from service.weather_service import WeatherService
+        return WeatherService()
+
+    @staticmethod
+    def _create_display_service(display: str) -> 'DisplayService':
+        from service.display_service import DisplayService
+        return DisplayService(output_path=None if display == Room.INKY_DISPLAY else display)
+
+    @staticmethod
+    def _create_spotify_service() -> 'SpotifyService':
+        from service.spotify_service import SpotifyService
+        return SpotifyService()
+
+    def _report_startup_profile(self) -> None:
+        # Reported once, after the first detection cycle, when startup is complete
+        if not self._startup_profiler:
+            return
+        self._music_detection_service.wait_until_loaded()
+        self._startup_profiler.uninstall()
+        self._logger.info(self._startup_profiler.report())
+        self._startup_profiler = None
 
-        self._state_manager.update_last_music_detected_time()
+    def _record_audio_and_detect_music(self) -> Tuple[Dict[str, np.ndarray], Dict[str, bool]]:
+        try:
+            audio_per_room = self._watchdog.run_stage(PipelineWatchdog.RECORD,
+                                                      lambda: self._audio_recording_service.get().record(
+                                                          duration=NowPlaying.AUDIO_RECORDING_DURATION_IN_SECONDS))
+        except StageBusyError:
+            raise
+        except StageTimeoutError:
+            self._recover_audio_device()
+            raise
+        except Exception:
+            self._reopen_audio_device()
+            raise
+        room_names = list(audio_per_room)
+        # All rooms are resampled in one call and classified in one interpreter invocation
+        resampled_audio = AudioProcessingUtils.resample(
+            np.stack([audio_per_room[room_name] for room_name in room_names]),
+            source_sampling_rate=NowPlaying.AUDIO_DEVICE_SAMPLING_RATE,
+            target_sampling_rate=NowPlaying.SUPPORTED_SAMPLING_RATE_BY_MUSIC_DETECTION_MODEL
+        ).reshape(len(room_names), -1)
+        # Waiting for the model that is still loading in the background does not count against the budget
+        music_detection_service = self._music_detection_service.get()
+        music_detected = self._watchdog.run_stage(PipelineWatchdog.DETECT,
+                                                  lambda: music_detection_service.are_music_detected(
+                                                      list(resampled_audio)))
+        return audio_per_room, dict(zip(room_names, music_detected))
 
-    def _trigger_song_identify(self, audio: np.ndarray) -> SongInfo:
+    @staticmethod
+    def _to_wav(audio: np.ndarray) -> io.BytesIO:
         int16_audio = AudioProcessingUtils.float32_to_int16(audio)
-        wav_audio = AudioProcessingUtils.to_wav(
+        return AudioProcessingUtils.to_wav(
             int16_audio,
             sampling_rate=NowPlaying.AUDIO_DEVICE_SAMPLING_RATE
         )
-        return self._song_identify_service.identify(wav_audio)
-
-    def _set_playing_state_and_update_display(self, song_info: SongInfo) -> None:
-        if self._state_manager.should_clean_display():
-            self._clean_display_and_set_clean_state()
-        self._state_manager.set_playing_state(song_info.title, song_info.artist)
-        self._display_service.update_display_to_playing(song_info)
-        self._state_manager.increase_image_counter()
-
-    def _handle_no_music_detected(self) -> None:
-        if (
-                self._state_manager.get_state().current != DisplayState.SCREENSAVER and self._state_manager.no_music_detected_for_more_than_a_minute()
-                or self._state_manager.screensaver_still_up_but_weather_info_outdated()
-        ):
-            weather_info = self._weather_service.get_weather_info()
-            self._set_screensaver_state_and_update_display(weather_info)
-
-    def _set_screensaver_state_and_update_display(self, weather_info: WeatherInfo) -> None:
-        if self._state_manager.should_clean_display():
-            self._clean_display_and_set_clean_state()
-        self._state_manager.set_screensaver_state(weather_info)
-        self._display_service.update_display_to_screensaver(weather_info)
-        self._state_manager.increase_image_counter()
 
-    @staticmethod
-    def _handle_exit(_sig, _frame):
+    def _measure_input_level(self, duration: float) -> float:
+        # Shares the audio devices with recording, so it runs in the same stage
+        try:
+            return self._watchdog.run_stage(PipelineWatchdog.RECORD,
+                                            lambda: self._audio_recording_service.get().measure_input_level(duration))
+        except StageBusyError:
+            return float('-inf')  # Logged once by the watchdog
+        except StageTimeoutError:
+            self._recover_audio_device()
+            raise
+
+    def _recover_audio_device(self) -> None:
+        # The stuck call is aborted first. PortAudio is only re-initialised once that call has returned, never
+        # underneath it.
+        if not self._audio_recording_service.is_initialised():
+            return
+        self._audio_recording_service.get().abort()
+        if not self._watchdog.wait_until_free(PipelineWatchdog.RECORD,
+                                              timeout=NowPlaying.AUDIO_ABORT_TIMEOUT_IN_SECONDS):
+            self._logger.error("Recording is still stuck after aborting it, leaving it to the watchdog.")
+            return
+        self._reopen_audio_device()
+
+    def _reopen_audio_device(self) -> None:
+        if not self._audio_recording_service.is_initialised():
+            return
+        try:
+            self._watchdog.run_stage(PipelineWatchdog.RECORD, lambda: self._audio_recording_service.get().reopen())
+        except Exception as e:
+            self._logger.error(f"Re-opening audio devices failed: {e}")
+
+    def _handle_exit(self, _sig, _frame) -> None:
+        watchdog = getattr(self, '_watchdog', None)
+        if watchdog:
+            watchdog.stop()
+        self._shutdown()
         sys.exit(0)
 
-    def _clean_display_and_set_clean_state(self) -> None:
-        self._display_service.clean_display()
-        self._state_manager.set_clean_state()
+    def _shutdown(self) -> None:
+        # Also run by the watchdog right before it restarts the service
+        play_history = getattr(self, '_play_history', None)  # Signals can arrive before it is set up
+        if play_history:
+            play_history.close()
+
+    def _handle_profiler_toggle(self, _sig, _frame) -> None:
+        sampling_profiler = getattr(self, '_sampling_profiler', None)  # Signals can arrive before it is set up
+        if sampling_profiler:
+            sampling_profiler.toggle()
+
+    def _describe_display_states(self) -> str:
+        rooms = getattr(self, '_rooms', [])  # Signals can arrive before the rooms are set up
+        if len(rooms) == 1:
+            return rooms[0].state_manager.get_state().current.name
+        return ','.join(f"{room.name}={room.state_manager.get_state().current.name}" for room in rooms)
 
     def _setup_buttons(self) -> None:
+        # Imported here so that the decision logic can be simulated on machines without GPIO
+        import gpiod
+        import gpiodevice
+        from gpiod.line import Bias, Direction, Edge
+
         chip = gpiodevice.find_chip_by_platform()
         self.OFFSETS = [chip.line_offset_from_id(id) for id in NowPlaying.BUTTONS]
-        line_config = dict.fromkeys(self.OFFSETS, NowPlaying.INPUT)
+        line_settings = gpiod.LineSettings(direction=Direction.INPUT, bias=Bias.PULL_UP, edge_detection=Edge.FALLING)
+        line_config = dict.fromkeys(self.OFFSETS, line_settings)
         self.request = chip.request_lines(consumer="inky7-buttons", config=line_config)
 
     def _start_button_listener(self) -> None:
@@ -151,19 +352,30 @@ class NowPlaying:
 
     def _handle_button_a(self) -> None:
         try:
-            if not self._state_manager.get_state().current == DisplayState.PLAYING:
+            state_manager = self._button_room.state_manager
+            if not state_manager.get_state().current == DisplayState.PLAYING:
                 return
-            title = self._state_manager.get_playing_state().song_title
-            artist = self._state_manager.get_playing_state().song_artist
-            track_uri = self._spotify_service.search_track_uri(title, artist)
+            title = state_manager.get_playing_state().song_title
+            artist = state_manager.get_playing_state().song_artist
+            spotify_service = self._spotify_service.get()  # Spotify OAuth is only set up on the first press
+            track_uri = spotify_service.search_track_uri(title, artist)
 
             if track_uri:
-                self._spotify_service.add_to_playlist(track_uri)
+                spotify_service.add_to_playlist(track_uri)
         except Exception as e:
             self._logger.error(f"Error occurred: {e}")
             self._logger.error(traceback.format_exc())
 
 
 if __name__ == "__main__":
-    service = NowPlaying()
+    parser = argparse.ArgumentParser(description="Listens for music, identifies it and shows it on an e-ink display.")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="log the import and initialisation cost per module after the first detection cycle")
+    parser.add_argument('--inject-fault', dest='faults', type=Fault.parse, action='append', default=[],
+                        metavar='SERVICE.METHOD:MODE[:SECONDS[:AFTER_CALLS]]',
+                        help="delay, hang or fail calls to a service, e.g. SongIdentifyService.identify:hang, "
+                             "to check how the watchdog degrades; can be repeated")
+    args = parser.parse_args()
+
+    service = NowPlaying(startup_profiler=_startup_profiler, faults=args.faults)
     service.run()
@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Final, Optional, TypeVar
+
+from logger import Logger
+from config import Config
+from systemd_notifier import SystemdNotifier
+
+T = TypeVar('T')
+
+
+class StageError(Exception):
+    pass
+
+
+class StageTimeoutError(StageError):
+    pass
+
+
+class StageBusyError(StageError):
+    def __init__(self, message: str, resource: str) -> None:
+        super().__init__(message)
+        self.resource: str = resource
+
+
+@dataclass
+class _StageCall:
+    stage: str
+    started_at: float
+    budget_seconds: float
+    done: threading.Event
+    busy_reported: bool = False
+
+
+# Runs every pipeline stage with a latency budget. A stage that exceeds its budget is abandoned: the caller gets a
+# StageTimeoutError and can degrade, while the stuck call keeps its resource (e.g. the audio device or a display) busy
+# until it returns. Liveness is reported to systemd; when the main loop stops making progress, or a stage stays stuck
+# for too long, the service is restarted after running the shutdown hook.
+class PipelineWatchdog:
+    RECORD: Final[str] = 'record'
+    DETECT: Final[str] = 'detect'
+    IDENTIFY: Final[str] = 'identify'
+    WEATHER: Final[str] = 'weather'
+    DISPLAY: Final[str] = 'display'
+    CLEAN: Final[str] = 'clean'
+    DEFAULT_BUDGETS_SECONDS: Final[Dict[str, float]] = {
+        RECORD: 15,
+        DETECT: 10,
+        IDENTIFY: 30,
+        WEATHER: 15,
+        DISPLAY: 90,  # Includes the album art download and the refresh of the e-ink panel
+        CLEAN: 180,
+    }
+    CHECK_INTERVAL_SECONDS: Final[float] = 10  # Without a systemd watchdog
+
+    def __init__(self, notifier: SystemdNotifier, shutdown_hook: Optional[Callable[[], None]] = None) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        config = Config().get_config().get('watchdog', {})
+        self._notifier: SystemdNotifier = notifier
+        self._shutdown_hook: Optional[Callable[[], None]] = shutdown_hook
+        self._enabled: bool = config.get('enabled', True)
+        self._budgets_seconds: Dict[str, float] = {**PipelineWatchdog.DEFAULT_BUDGETS_SECONDS,
+                                                   **config.get('budgets_seconds', {})}
+        self._stall_seconds: float = config.get('stall_seconds', 180)
+        self._cooldown_seconds: float = config.get('cooldown_minutes', 10) * 60
+
+        self._lock: threading.Lock = threading.Lock()
+        self._in_flight: Dict[str, _StageCall] = {}
+        self._suspended_until: Dict[str, float] = {}
+        self._last_kick: float = time.monotonic()
+        self._degraded: bool = False
+        self._stop_event: threading.Event = threading.Event()
+
+    def start(self) -> None:
+        # Liveness is always reported, as systemd restarts a service that stops doing so
+        watchdog_interval_seconds = self._notifier.get_watchdog_interval_seconds()
+        check_interval_seconds = (watchdog_interval_seconds / 2 if watchdog_interval_seconds
+                                  else PipelineWatchdog.CHECK_INTERVAL_SECONDS)
+        threading.Thread(target=self._heartbeat, args=(check_interval_seconds,), name="watchdog", daemon=True).start()
+
+    def ready(self) -> None:
+        self.kick()
+        self._notifier.notify('READY=1')
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._notifier.notify('STOPPING=1')
+
+    def kick(self) -> None:
+        self._last_kick = time.monotonic()
+
+    def run_stage(self, stage: str, function: Callable[[], T], resource: Optional[str] = None) -> T:
+        # Stages sharing a resource, e.g. cleaning and updating the same display, never run concurrently
+        if not self._enabled:
+            return function()
+        resource = resource or stage
+        budget_seconds = self._budgets_seconds[stage]
+        result: Dict[str, object] = {}
+        done = threading.Event()
+
+        def call() -> None:
+            try:
+                result['value'] = function()
+            except BaseException as e:
+                result['error'] = e
+            finally:
+                with self._lock:
+                    self._in_flight.pop(resource, None)
+                done.set()
+
+        with self._lock:
+            stuck_call = self._in_flight.get(resource)
+            if stuck_call:
+                message = (f"{resource} is still held by a stuck {stuck_call.stage} stage, "
+                           f"{time.monotonic() - stuck_call.started_at:.0f}s after it started.")
+                if not stuck_call.busy_reported:  # Logged once per stuck call, not on every attempt
+                    stuck_call.busy_reported = True
+                    self._logger.warning(message)
+                raise StageBusyError(message, resource)
+            self._in_flight[resource] = _StageCall(stage, time.monotonic(), budget_seconds, done)
+        threading.Thread(target=call, name=f"stage-{resource}", daemon=True).start()
+
+        finished = done.wait(budget_seconds)
+        self.kick()
+        if not finished:
+            self._report_degraded(f"{stage} exceeded its budget of {budget_seconds:g}s")
+            raise StageTimeoutError(f"Stage {stage} exceeded its budget of {budget_seconds:g}s.")
+        self._report_recovered()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def wait_until_free(self, resource: str, timeout: Optional[float] = None) -> bool:
+        # Blocks until the call holding the resource returns, so that callers back off instead of retrying right away.
+        # A call that never returns is left to the stall detection.
+        with self._lock:
+            stuck_call = self._in_flight.get(resource)
+        if not stuck_call:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not stuck_call.done.wait(1.0):  # Short waits, so that signals are handled
+            if self._stop_event.is_set() or (deadline is not None and time.monotonic() >= deadline):
+                return False
+        return True
+
+    def suspend_stage(self, stage: str) -> None:
+        self._suspended_until[stage] = time.monotonic() + self._cooldown_seconds
+        self._report_degraded(f"skipping {stage} for {self._cooldown_seconds / 60:g} minutes")
+
+    def is_stage_suspended(self, stage: str) -> bool:
+        return time.monotonic() < self._suspended_until.get(stage, 0.0)
+
+    def _report_degraded(self, reason: str) -> None:
+        self._degraded = True
+        self._notifier.notify(f"STATUS=Degraded: {reason}")
+
+    def _report_recovered(self) -> None:
+        # Once no call is stuck and no stage is skipped anymore
+        if not self._degraded:
+            return
+        with self._lock:
+            if self._in_flight:
+                return
+        if any(self.is_stage_suspended(stage) for stage in self._suspended_until):
+            return
+        self._degraded = False
+        self._logger.info("All pipeline stages are back within their budgets.")
+        self._notifier.notify('STATUS=Running')
+
+    def _heartbeat(self, check_interval_seconds: float) -> None:
+        while not self._stop_event.wait(check_interval_seconds):
+            stall = self._find_stall()
+            if stall is None:
+                self._notifier.notify('WATCHDOG=1')
+                continue
+
+            self._logger.critical(f"{stall} Restarting.")
+            if self._shutdown_hook:
+                try:
+                    self._shutdown_hook()
+                except Exception as e:
+                    self._logger.error(f"Shutdown before restart failed: {e}")
+            if self._notifier.get_watchdog_interval_seconds():
+                self._notifier.notify('WATCHDOG=trigger')
+            else:
+                # Without a systemd watchdog, exiting lets Restart=on-failure take over
+                logging.shutdown()
+                os._exit(1)
+            return
+
+    def _find_stall(self) -> Optional[str]:
+        if not self._enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            in_flight = dict(self._in_flight)
+        for resource, stage_call in in_flight.items():
+            if now - stage_call.started_at - stage_call.budget_seconds > self._stall_seconds:
+                return f"Stage {stage_call.stage} has been stuck on {resource} for {now - stage_call.started_at:.0f}s."
+        # The main loop waiting on a stage within its budget counts as progress
+        waiting_on_stage = any(now - stage_call.started_at <= stage_call.budget_seconds
+                               for stage_call in in_flight.values())
+        if not waiting_on_stage and now - self._last_kick > self._stall_seconds:
+            return f"Main loop made no progress for {now - self._last_kick:.0f}s."
+        return None
@@ -0,0 +1,162 @@
+import argparse
+import datetime
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Tuple
+
+from logger import Logger
+from config import Config
+
+
+@dataclass(frozen=True)
+class Play:
+    played_at: datetime.datetime
+    title: Optional[str]
+    artist: Optional[str]
+    album: Optional[str] = None
+    room: Optional[str] = None
+
+
+# Identified songs in an SQLite database. Plays are buffered in memory and written in batches to limit SD card writes;
+# when writing keeps failing, the buffer is bounded and the oldest plays are dropped first.
+class PlayHistory:
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS plays ('
+        'id INTEGER PRIMARY KEY, played_at INTEGER NOT NULL, artist TEXT, title TEXT, album TEXT, room TEXT)',
+        'CREATE INDEX IF NOT EXISTS plays_played_at ON plays (played_at)',
+        'CREATE INDEX IF NOT EXISTS plays_artist_title ON plays (artist, title, played_at)',
+    ]
+
+    def __init__(self, database_path: str, batch_size: int = 20, flush_interval_minutes: float = 15,
+                 max_buffer_size: int = 1000) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._batch_size: int = batch_size
+        self._flush_interval_seconds: float = flush_interval_minutes * 60
+        self._buffer: Deque[Play] = deque(maxlen=max_buffer_size)
+        self._last_flush: float = time.monotonic()
+        self._lock: threading.RLock = threading.RLock()
+
+        self._connection: sqlite3.Connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')  # Lets the CLI read while the service writes
+        self._connection.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL, and a lot fewer fsyncs
+        with self._connection:
+            for statement in PlayHistory.SCHEMA:
+                self._connection.execute(statement)
+
+    @staticmethod
+    def from_config(config: dict) -> Optional['PlayHistory']:
+        play_history_config = config.get('play_history', {})
+        if not play_history_config.get('database_path'):
+            return None
+        return PlayHistory(**play_history_config)
+
+    def record(self, play: Play) -> None:
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._logger.warning("Play history buffer is full, dropping the oldest play.")
+            self._buffer.append(play)
+            if len(self._buffer) >= self._batch_size:
+                self.flush()
+
+    def flush_if_due(self) -> None:
+        with self._lock:
+            if self._buffer and time.monotonic() - self._last_flush >= self._flush_interval_seconds:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+            rows = [(int(play.played_at.timestamp()), play.artist, play.title, play.album, play.room)
+                    for play in self._buffer]
+            try:
+                with self._connection:
+                    self._connection.executemany(
+                        'INSERT INTO plays (played_at, artist, title, album, room) VALUES (?, ?, ?, ?, ?)', rows)
+                self._buffer.clear()
+                self._logger.debug(f"Wrote {len(rows)} plays to the play history.")
+            except sqlite3.Error as e:
+                self._logger.error(f"Writing play history failed, keeping {len(rows)} plays buffered: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._connection.close()
+
+    def recent_plays(self, limit: int = 20, since: Optional[datetime.datetime] = None) -> List[Play]:
+        self.flush()
+        rows = self._connection.execute(
+            'SELECT played_at, title, artist, album, room FROM plays WHERE played_at >= ? '
+            'ORDER BY played_at DESC LIMIT ?', (PlayHistory._to_timestamp(since), limit)).fetchall()
+        return [Play(datetime.datetime.fromtimestamp(played_at), title, artist, album, room)
+                for played_at, title, artist, album, room in rows]
+
+    def top_artists(self, limit: int = 10, since: Optional[datetime.datetime] = None) -> List[Tuple[str, int]]:
+        self.flush()
+        return self._connection.execute(
+            'SELECT artist, COUNT(*) AS plays FROM plays WHERE played_at >= ? AND artist IS NOT NULL '
+            'GROUP BY artist ORDER BY plays DESC, artist LIMIT ?', (PlayHistory._to_timestamp(since), limit)).fetchall()
+
+    def play_counts(self, artist: Optional[str] = None, title: Optional[str] = None,
+                    since: Optional[datetime.datetime] = None, limit: int = 20) -> List[Tuple[str, str, int]]:
+        self.flush()
+        conditions = ['played_at >= ?']
+        parameters: list = [PlayHistory._to_timestamp(since)]
+        if artist is not None:
+            conditions.append('artist = ?')
+            parameters.append(artist)
+        if title is not None:
+            conditions.append('title = ?')
+            parameters.append(title)
+        return self._connection.execute(
+            f"SELECT artist, title, COUNT(*) AS plays FROM plays WHERE {' AND '.join(conditions)} "
+            f"GROUP BY artist, title ORDER BY plays DESC, artist, title LIMIT ?", parameters + [limit]).fetchall()
+
+    @staticmethod
+    def _to_timestamp(since: Optional[datetime.datetime]) -> int:
+        return int(since.timestamp()) if since else 0
+
+
+def _parse_since(value: str) -> datetime.datetime:
+    # Either relative, e.g. 12h, 7d or 4w, or an ISO date(time)
+    relative = re.fullmatch(r'(\d+)([hdw])', value)
+    if relative:
+        amount, unit = int(relative.group(1)), relative.group(2)
+        return datetime.datetime.now() - datetime.timedelta(**{{'h': 'hours', 'd': 'days', 'w': 'weeks'}[unit]: amount})
+    return datetime.datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries the history of identified songs.")
+    parser.add_argument('--since', type=_parse_since, help="only plays since, e.g. 12h, 7d, 4w or 2025-01-31")
+    parser.add_argument('--limit', type=int, default=20)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('recent', help="most recent plays")
+    subparsers.add_parser('top-artists', help="most played artists")
+    counts_parser = subparsers.add_parser('counts', help="play counts per song")
+    counts_parser.add_argument('--artist')
+    counts_parser.add_argument('--title')
+    args = parser.parse_args()
+
+    play_history = PlayHistory.from_config(Config().get_config())
+    if play_history is None:
+        parser.exit(1, "No play_history.database_path configured in config.yaml.\n")
+
+    if args.command == 'recent':
+        for recent_play in play_history.recent_plays(args.limit, args.since):
+            room = f" [{recent_play.room}]" if recent_play.room else ''
+            print(f"{recent_play.played_at:%Y-%m-%d %H:%M}  {recent_play.artist} - {recent_play.title}{room}")
+    elif args.command == 'top-artists':
+        for top_artist, play_count in play_history.top_artists(args.limit, args.since):
+            print(f"{play_count:6}  {top_artist}")
+    else:
+        for song_artist, song_title, play_count in play_history.play_counts(args.artist, args.title, args.since,
+                                                                            args.limit):
+            print(f"{play_count:6}  {song_artist} - {song_title}")
+    play_history.close()
@@ -0,0 +1,22 @@
+from dataclasses import dataclass
+from typing import ClassVar, TYPE_CHECKING
+
+from lazy_service import LazyService
+from state_manager import StateManager
+
+if TYPE_CHECKING:
+    from service.display_service import DisplayService
+
+
+@dataclass(frozen=True)
+class Room:
+    INKY_DISPLAY: ClassVar[str] = 'inky'
+
+    name: str
+    input_device: str  # Case-insensitive part of the audio device name, or 'wav:<path>' for a virtual input
+    display: str  # 'inky' for the e-ink display, otherwise the path the rendered image is written to
+    state_manager: StateManager
+    display_service: LazyService['DisplayService']
+
+    def has_inky_display(self) -> bool:
+        return self.display == Room.INKY_DISPLAY
@@ -0,0 +1,151 @@
+import datetime
+import logging
+from typing import Any, Callable, Optional, TypeVar, TYPE_CHECKING
+
+from logger import Logger
+from state_manager import DisplayState
+from lazy_service import LazyService
+from detection_trace import DetectionTrace, DetectionTraceEvent
+from room import Room
+from play_history import PlayHistory, Play
+from pipeline_watchdog import PipelineWatchdog, StageError, StageBusyError, StageTimeoutError
+
+if TYPE_CHECKING:
+    from service.song_identify_service import SongIdentifyService, SongInfo
+    from service.weather_service import WeatherService, WeatherInfo
+
+T = TypeVar('T')
+
+
+# Decides, per room, what to show after every detection cycle. All collaborators are passed in, so that the same logic
+# runs in the service and in the simulator.
+class RoomController:
+    def __init__(self, song_identify_service: LazyService['SongIdentifyService'],
+                 weather_service: LazyService['WeatherService'],
+                 detection_trace: Optional[DetectionTrace] = None,
+                 play_history: Optional[PlayHistory] = None,
+                 watchdog: Optional[PipelineWatchdog] = None,
+                 clock: Callable[[], datetime.datetime] = datetime.datetime.now) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._song_identify_service: LazyService['SongIdentifyService'] = song_identify_service
+        self._weather_service: LazyService['WeatherService'] = weather_service
+        self._detection_trace: Optional[DetectionTrace] = detection_trace
+        self._play_history: Optional[PlayHistory] = play_history
+        self._watchdog: Optional[PipelineWatchdog] = watchdog
+        self._clock: Callable[[], datetime.datetime] = clock
+
+    # The recording is passed to the song identify service as it is, e.g. a WAV buffer
+    def handle_music_detected(self, room: Room, recording: Any) -> None:
+        state_manager = room.state_manager
+        song_info = self._trigger_song_identify(recording)
+        if (
+                song_info
+                and (state_manager.get_state().current != DisplayState.PLAYING
+                     or state_manager.music_still_playing_but_different_song_identified(song_info.title))
+        ):
+            self._set_playing_state_and_update_display(room, song_info)
+
+        state_manager.update_last_music_detected_time()
+        self._append_to_detection_trace(room, True, song_info)
+
+    def handle_no_music_detected(self, room: Room) -> None:
+        state_manager = room.state_manager
+        if (
+                state_manager.get_state().current != DisplayState.SCREENSAVER and state_manager.no_music_detected_for_too_long()
+                or state_manager.screensaver_still_up_but_weather_info_outdated()
+        ):
+            weather_info = self._get_weather_info()
+            self._set_screensaver_state_and_update_display(room, weather_info)
+
+        self._append_to_detection_trace(room, False, None)
+
+    def clean_display_and_set_clean_state(self, room: Room) -> None:
+        self._run_stage(PipelineWatchdog.CLEAN, lambda: room.display_service.get().clean_display(),
+                        RoomController._display_resource(room))
+        room.state_manager.set_clean_state()
+
+    def _run_stage(self, stage: str, function: Callable[[], T], resource: Optional[str] = None) -> T:
+        if not self._watchdog:
+            return function()
+        return self._watchdog.run_stage(stage, function, resource)
+
+    def _trigger_song_identify(self, recording: Any) -> Optional['SongInfo']:
+        if self._watchdog and self._watchdog.is_stage_suspended(PipelineWatchdog.IDENTIFY):
+            return None
+        # Services are constructed outside of the stage, their first construction does not count against the budget
+        song_identify_service = self._song_identify_service.get()
+        try:
+            return self._run_stage(PipelineWatchdog.IDENTIFY, lambda: song_identify_service.identify(recording))
+        except StageError as e:
+            self._logger.warning(f"Skipping song identification for a while: {e}")
+            self._watchdog.suspend_stage(PipelineWatchdog.IDENTIFY)
+            return None
+
+    def _get_weather_info(self) -> 'WeatherInfo':
+        weather_service = self._weather_service.get()
+        return self._run_stage(PipelineWatchdog.WEATHER, weather_service.get_weather_info)
+
+    def _set_playing_state_and_update_display(self, room: Room, song_info: 'SongInfo') -> None:
+        if room.state_manager.should_clean_display():
+            self.clean_display_and_set_clean_state(room)
+        room.state_manager.set_playing_state(song_info.title, song_info.artist)
+        self._record_play(room, song_info)
+        try:
+            self._run_stage(PipelineWatchdog.DISPLAY,
+                            lambda: room.display_service.get().update_display_to_playing(song_info),
+                            RoomController._display_resource(room))
+        except StageBusyError:
+            raise  # The screensaver cannot be shown on a display that is still stuck either
+        except StageTimeoutError as e:
+            # The panel is still busy with the stuck update, so the state is kept and nothing else is shown
+            self._logger.warning(f"Display update in room '{room.name}' is taking too long: {e}")
+            return
+        except Exception as e:
+            self._fall_back_to_screensaver(room, e)
+            return
+        room.state_manager.increase_image_counter()
+
+    def _fall_back_to_screensaver(self, room: Room, error: Exception) -> None:
+        # The playing state is kept, so that the album art is only retried once a different song is identified
+        self._logger.warning(f"Showing the screensaver in room '{room.name}' instead of the album art: {error}")
+        weather_info = self._get_weather_info()
+        self._run_stage(PipelineWatchdog.DISPLAY,
+                        lambda: room.display_service.get().update_display_to_screensaver(weather_info),
+                        RoomController._display_resource(room))
+        room.state_manager.increase_image_counter()
+
+    def _record_play(self, room: Room, song_info: 'SongInfo') -> None:
+        if not self._play_history:
+            return
+        self._play_history.record(Play(
+            played_at=self._clock(),
+            title=song_info.title,
+            artist=song_info.artist,
+            album=song_info.album,
+            room=room.name
+        ))
+
+    def _set_screensaver_state_and_update_display(self, room: Room, weather_info: 'WeatherInfo') -> None:
+        if room.state_manager.should_clean_display():
+            self.clean_display_and_set_clean_state(room)
+        room.state_manager.set_screensaver_state(weather_info)
+        self._run_stage(PipelineWatchdog.DISPLAY,
+                        lambda: room.display_service.get().update_display_to_screensaver(weather_info),
+                        RoomController._display_resource(room))
+        room.state_manager.increase_image_counter()
+
+    def _append_to_detection_trace(self, room: Room, music_detected: bool, song_info: Optional['SongInfo']) -> None:
+        if not self._detection_trace:
+            return
+        self._detection_trace.append(DetectionTraceEvent(
+            timestamp=self._clock(),
+            music_detected=music_detected,
+            song_title=song_info.title if song_info else None,
+            song_artist=song_info.artist if song_info else None,
+            room=room.name
+        ))
+
+    @staticmethod
+    def _display_resource(room: Room) -> str:
+        # Cleaning and updating a display share the same panel
+        return f"display[{room.name}]"
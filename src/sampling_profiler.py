@@ -0,0 +1,88 @@
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Callable, Dict, List, Optional
+
+from logger import Logger
+from config import Config
+
+
+# Periodically samples the stacks of all threads and writes them in the collapsed stack format understood by
+# flamegraph.pl, speedscope and similar tools. Every stack is prefixed with the display state at the time of the sample.
+class SamplingProfiler:
+    def __init__(self, tag_provider: Callable[[], str]) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        config = Config().get_config()
+        profiler_config = config.get('profiler', {})
+        default_output_dir = os.path.join(os.path.dirname(config['log']['log_file_path']), 'profiles')
+        self._output_dir: str = profiler_config.get('output_dir', default_output_dir)
+        self._sampling_interval_seconds: float = profiler_config.get('sampling_interval_ms', 10) / 1000
+        self._duration_seconds: float = profiler_config.get('duration_seconds', 60)
+        self._tag_provider: Callable[[], str] = tag_provider
+
+        self._stop_event: threading.Event = threading.Event()
+        self._sampler_thread: Optional[threading.Thread] = None
+
+    def toggle(self) -> None:
+        # Only called from the SIGUSR1 handler on the main thread, which may interrupt itself when the signal is sent
+        # twice in quick succession, so no lock is taken
+        if self._sampler_thread is not None and self._sampler_thread.is_alive():
+            self._logger.info("Stopping sampling profiler.")
+            self._stop_event.set()
+            return
+
+        self._logger.info(f"Starting sampling profiler for at most {self._duration_seconds}s, "
+                          f"sampling every {self._sampling_interval_seconds * 1000:g} ms.")
+        self._stop_event.clear()
+        self._sampler_thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._sampler_thread.start()
+
+    def _sample(self) -> None:
+        started_at = datetime.datetime.now()
+        start_tag = self._tag_provider()
+        deadline = time.monotonic() + self._duration_seconds
+        stacks: Counter = Counter()
+        samples = 0
+
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            tag = self._tag_provider()
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == threading.get_ident():
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                stacks[';'.join([f"state:{tag}", f"thread:{thread_name}"] + SamplingProfiler._collapse(frame))] += 1
+            samples += 1
+            self._stop_event.wait(self._sampling_interval_seconds)
+
+        self._write(stacks, samples, started_at, start_tag)
+
+    @staticmethod
+    def _collapse(frame: Optional[FrameType]) -> List[str]:
+        # Outermost frame first. Frames are identified by their function, not the line being executed, so that
+        # samples taken at different lines of the same function are merged.
+        collapsed = []
+        while frame is not None:
+            code = frame.f_code
+            collapsed.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                             .replace(';', ':'))
+            frame = frame.f_back
+        collapsed.reverse()
+        return collapsed
+
+    def _write(self, stacks: Dict[str, int], samples: int, started_at: datetime.datetime, start_tag: str) -> None:
+        file_name = f"profile-{started_at.strftime('%Y%m%d-%H%M%S')}-{start_tag.replace(',', '_')}.folded"
+        output_path = os.path.join(self._output_dir, file_name)
+        try:
+            os.makedirs(self._output_dir, exist_ok=True)
+            with open(output_path, 'w') as output_file:
+                for stack, count in sorted(stacks.items()):
+                    output_file.write(f"{stack} {count}\n")
+            self._logger.info(f"Sampling profiler wrote {samples} samples to {output_path}.")
+        except OSError as e:
+            self._logger.error(f"Writing profile to {output_path} failed: {e}")
@@ -1,56 +1,201 @@
 import logging
+import threading
+import time
 
 import sounddevice as sd
 import numpy as np
-from typing import Optional, Tuple
+from typing import Dict, Final, List, Optional, Tuple
 
 import sys
 sys.path.append("..")
 from logger import Logger
 
 
+class _DeviceRecording:
+    def __init__(self, frames: int, channels: int) -> None:
+        self.buffer: np.ndarray = np.zeros((frames, channels), dtype=np.float32)
+        self.position: int = 0
+        self.done: threading.Event = threading.Event()
+        self.aborted: bool = False
+
+    def abort(self) -> None:
+        self.aborted = True
+        self.done.set()
+
+    def callback(self, indata: np.ndarray, frame_count: int, _time_info, _status) -> None:
+        if self.aborted:
+            raise sd.CallbackAbort
+        frames_to_copy = min(frame_count, len(self.buffer) - self.position)
+        self.buffer[self.position:self.position + frames_to_copy] = indata[:frames_to_copy]
+        self.position += frames_to_copy
+        if self.position >= len(self.buffer):
+            self.done.set()
+            raise sd.CallbackStop
+
+
+class _WavInput:
+    # Virtual input that plays back a WAV file in a loop, e.g. to test multi-room detection without microphones
+    def __init__(self, wav_file_path: str, sampling_rate: int) -> None:
+        import scipy.io.wavfile as wav
+        from audio_processing_utils import AudioProcessingUtils
+
+        source_sampling_rate, audio = wav.read(wav_file_path)
+        if np.issubdtype(audio.dtype, np.integer):
+            audio = audio.astype(np.float32) / np.iinfo(audio.dtype).max
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        if source_sampling_rate != sampling_rate:
+            audio = AudioProcessingUtils.resample(audio, source_sampling_rate, sampling_rate)
+        self._audio: np.ndarray = audio.astype(np.float32)
+        self._position: int = 0
+
+    def read(self, frames: int) -> np.ndarray:
+        indices = (self._position + np.arange(frames)) % len(self._audio)
+        self._position = (self._position + frames) % len(self._audio)
+        return self._audio[indices]
+
+
 class AudioRecordingService:
-    def __init__(self, sampling_rate: int, channels: int) -> None:
+    DEFAULT_INPUT_NAME: Final[str] = 'default'
+    WAV_INPUT_PREFIX: Final[str] = 'wav:'
+
+    # input_devices maps an input name (e.g. a room) to a case-insensitive part of the device name,
+    # or to 'wav:<path>' for a virtual input backed by a WAV file
+    def __init__(self, sampling_rate: int, channels: int, input_devices: Optional[Dict[str, str]] = None) -> None:
         self._logger: logging.Logger = Logger().get_logger()
         self._sampling_rate: int = sampling_rate
         self._channels: int = channels
+        self._input_devices: Dict[str, str] = input_devices or {AudioRecordingService.DEFAULT_INPUT_NAME: 'usb'}
+        self._device_indices: Dict[str, Optional[int]] = {}  # None is the system default device
+        self._wav_inputs: Dict[str, _WavInput] = {}
+        self._active_recordings: List[_DeviceRecording] = []
+        self._lock: threading.Lock = threading.Lock()
         self._setup_device()
 
     def _setup_device(self) -> None:
         try:
             sd.default.samplerate = self._sampling_rate
             sd.default.channels = self._channels
-            device_information = self._get_device_information()
-            if device_information:
-                device_index, device_name = device_information
-                sd.default.device = (device_index, None)
-                self._logger.debug(f"Using audio device: {device_name}")
-            else:
-                self._logger.error("No audio device found.")
+            for input_name, device in self._input_devices.items():
+                if device.startswith(AudioRecordingService.WAV_INPUT_PREFIX):
+                    wav_file_path = device[len(AudioRecordingService.WAV_INPUT_PREFIX):]
+                    self._wav_inputs[input_name] = _WavInput(wav_file_path, self._sampling_rate)
+                    self._logger.debug(f"Using WAV file {wav_file_path} as audio input '{input_name}'")
+                    continue
+
+                device_information = self._get_device_information(device)
+                if device_information:
+                    device_index, device_name = device_information
+                    self._device_indices[input_name] = device_index
+                    self._logger.debug(f"Using audio device {device_name} as audio input '{input_name}'")
+                elif len(self._input_devices) == 1:
+                    self._device_indices[input_name] = None
+                    self._logger.error(f"No audio device found for audio input '{input_name}', "
+                                       f"using the default device.")
+                else:
+                    # With several inputs, the default device is most likely another room's microphone
+                    self._logger.error(f"No audio device found for audio input '{input_name}', skipping it.")
         except Exception as e:
             self._logger.error(f"Audio device setup failed: {e}")
             raise RuntimeError("Audio device setup failed.") from e
 
-    def _get_device_information(self) -> Optional[Tuple[int, str]]:
+    def _get_device_information(self, device: str) -> Optional[Tuple[int, str]]:
         try:
             devices = sd.query_devices()
-            for idx, device in enumerate(devices):
-                if 'usb' in device['name'].lower():
-                    return idx, device['name']
+            for idx, device_information in enumerate(devices):
+                if device_information['max_input_channels'] > 0 and device.lower() in device_information['name'].lower():
+                    return idx, device_information['name']
             return None
         except Exception as e:
             self._logger.error(f"Device query failed: {e}")
             return None
 
-    def record(self, duration: float) -> np.ndarray:
+    def abort(self) -> None:
+        # Stops a running recording from another thread. The recording thread itself closes its streams.
+        with self._lock:
+            active_recordings = list(self._active_recordings)
+        if active_recordings:
+            self._logger.warning("Aborting the running recording.")
+        for recording in active_recordings:
+            recording.abort()
+
+    def reopen(self) -> None:
+        # Re-initialising PortAudio rescans the devices, e.g. after a USB microphone was reconnected. It closes every
+        # open stream, so it must only be called while no recording is running.
+        self._logger.warning("Re-opening audio devices.")
+        try:
+            sd._terminate()
+            sd._initialize()
+        except Exception as e:
+            self._logger.error(f"Re-initialising PortAudio failed: {e}")
+        self._device_indices = {}
+        self._wav_inputs = {}
+        self._setup_device()
+
+    def get_available_input_names(self) -> list[str]:
+        return [input_name for input_name in self._input_devices
+                if input_name in self._device_indices or input_name in self._wav_inputs]
+
+    def record(self, duration: float) -> Dict[str, np.ndarray]:
         if duration <= 0:
             raise ValueError("Duration must be positive.")
 
         try:
-            self._logger.info(f"Recording for {duration} seconds at {self._sampling_rate} Hz.")
-            audio = sd.rec(int(duration * self._sampling_rate), dtype=np.float32)
-            sd.wait()
-            return np.squeeze(audio)
+            self._logger.info(f"Recording {len(self._input_devices)} input(s) for {duration} seconds at "
+                              f"{self._sampling_rate} Hz.")
+            return self._record_all_inputs(duration)
         except Exception as e:
             self._logger.error(f"Recording failed: {e}")
             raise RuntimeError("Recording failed.") from e
+
+    def measure_input_level(self, duration: float) -> float:
+        # Cheap loudness probe in dBFS of the loudest input, used to wake up the detection loop without running the
+        # ML model
+        if duration <= 0:
+            raise ValueError("Duration must be positive.")
+
+        try:
+            input_levels = []
+            for audio in self._record_all_inputs(duration).values():
+                rms = float(np.sqrt(np.mean(np.square(audio)))) if audio.size else 0.0
+                input_levels.append(float(20 * np.log10(max(rms, 1e-10))))
+            return max(input_levels)
+        except Exception as e:
+            self._logger.error(f"Input level measurement failed: {e}")
+            raise RuntimeError("Input level measurement failed.") from e
+
+    def _record_all_inputs(self, duration: float) -> Dict[str, np.ndarray]:
+        # All devices record simultaneously, so the recording time does not grow with the number of inputs. Inputs
+        # without a device are left out.
+        if not self._device_indices and not self._wav_inputs:
+            raise RuntimeError("No audio input available.")
+        frames = int(duration * self._sampling_rate)
+        recordings: Dict[str, _DeviceRecording] = {}
+        streams = []
+        try:
+            for input_name, device_index in self._device_indices.items():
+                recording = _DeviceRecording(frames, self._channels)
+                stream = sd.InputStream(device=device_index, samplerate=self._sampling_rate, channels=self._channels,
+                                        dtype=np.float32, callback=recording.callback)
+                recordings[input_name] = recording
+                streams.append(stream)
+            with self._lock:
+                self._active_recordings = list(recordings.values())
+            for stream in streams:
+                stream.start()
+
+            audio = {input_name: wav_input.read(frames) for input_name, wav_input in self._wav_inputs.items()}
+            if not recordings:
+                time.sleep(duration)  # WAV inputs deliver audio in real time, like a microphone would
+            for input_name, recording in recordings.items():
+                if not recording.done.wait(timeout=duration * 2 + 1):
+                    raise RuntimeError(f"Audio input '{input_name}' stopped delivering audio.")
+                if recording.aborted:
+                    raise RuntimeError("Recording was aborted.")
+                audio[input_name] = np.squeeze(recording.buffer)
+            return {input_name: audio[input_name] for input_name in self.get_available_input_names()}
+        finally:
+            with self._lock:
+                self._active_recordings = []
+            for stream in streams:
+                stream.close()
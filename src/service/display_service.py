@@ -1,10 +1,9 @@
 import logging
 import time
 import traceback
+from typing import Final, Optional, Tuple, TYPE_CHECKING
 import requests
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-from service.weather_service import WeatherInfo
-from service.song_identify_service import SongInfo
+from PIL import Image, ImageDraw, ImageFont
 from inky.auto import auto
 from inky.inky_uc8159 import CLEAN
 
@@ -13,14 +12,24 @@ sys.path.append("..")
 from logger import Logger
 from config import Config
 
+if TYPE_CHECKING:
+    from service.weather_service import WeatherInfo
+    from service.song_identify_service import SongInfo
+
 
 class DisplayService:
-    def __init__(self) -> None:
+    ALBUM_ART_DOWNLOAD_TIMEOUT_SECONDS: Final[int] = 10
+
+    # Without an output path the image is shown on the Inky display, otherwise it is written to that file
+    def __init__(self, output_path: Optional[str] = None) -> None:
         self._config: dict = Config().get_config()
         self._logger: logging.Logger = Logger().get_logger()
-        self._inky = auto()
+        self._output_path: Optional[str] = output_path
+        self._inky = auto() if output_path is None else None
 
     def clean_display(self) -> None:
+        if self._inky is None:
+            return  # Only e-ink panels suffer from ghosting
         try:
             for _ in range(2):
                 for y in range(self._inky.height - 1):
@@ -32,38 +41,57 @@ class DisplayService:
             self._logger.error(f"Error cleaning display: {e}")
             self._logger.error(traceback.format_exc())
 
-    def update_display_to_playing(self, song_info: SongInfo) -> None:
-        album_cover_image = Image.open(requests.get(song_info.album_art, stream=True).raw)
+    def update_display_to_playing(self, song_info: 'SongInfo') -> None:
+        album_cover_image = Image.open(requests.get(song_info.album_art, stream=True,
+                                                    timeout=DisplayService.ALBUM_ART_DOWNLOAD_TIMEOUT_SECONDS).raw)
         display_image = self._generate_display_image(album_cover_image, song_info.title, song_info.artist,
                                                      self._config['display']['small_album_cover'])
         self._show_image_on_display(display_image)
 
-    def update_display_to_screensaver(self, weather_info: WeatherInfo) -> None:
+    def update_display_to_screensaver(self, weather_info: 'WeatherInfo') -> None:
         screensaver_image = Image.open(self._config['display']['screensaver_image'])
         display_image = self._generate_display_image(screensaver_image, weather_info.temperature,
                                                      weather_info.sub_description, False)
         self._show_image_on_display(display_image)
 
     def _generate_display_image(self, image: Image, title: str, subtitle: str, small_album_cover: bool) -> Image:
-        image = self._fit_background_image(image)
+        display_size = (self._config['display']['width'], self._config['display']['height'])
+        # JPEGs are decoded at the smallest DCT scale that still covers the display, which is a lot cheaper than
+        # decoding e.g. a 1400x1400 album cover at full resolution
+        image.draft('RGB', display_size)
+        crop_box = DisplayService.get_crop_box(image.size, display_size)
+
+        background_image = self._fit_background_image(image, crop_box)
 
         if small_album_cover:
-            self._add_smaller_album_cover(image)
+            self._add_smaller_album_cover(background_image, image, crop_box)
 
-        self._add_text(image, title, subtitle)
-        return image
+        self._add_text(background_image, title, subtitle)
+        return background_image
 
-    def _fit_background_image(self, image: Image) -> Image:
+    @staticmethod
+    def get_crop_box(image_size: Tuple[int, int], target_size: Tuple[int, int]) -> Tuple[float, float, float, float]:
+        # Largest top-left aligned region with the aspect ratio of the target, as ImageOps.fit with centering (0, 0)
+        image_width, image_height = image_size
+        target_ratio = target_size[0] / target_size[1]
+        if image_width / image_height >= target_ratio:
+            return 0, 0, target_ratio * image_height, image_height
+        return 0, 0, image_width, image_width / target_ratio
+
+    def _fit_background_image(self, image: Image, crop_box: Tuple[float, float, float, float]) -> Image:
         display_width = self._config['display']['width']
         display_height = self._config['display']['height']
-        return ImageOps.fit(image, (display_width, display_height), centering=(0, 0))
+        return image.resize((display_width, display_height), Image.BICUBIC, box=crop_box)
 
-    def _add_smaller_album_cover(self, image) -> None:
+    def _add_smaller_album_cover(self, background_image: Image, image: Image,
+                                 crop_box: Tuple[float, float, float, float]) -> None:
+        # Resampled straight from the source rather than from the already resampled background
         offset_px_top = self._config['display']['offset_top_px']
         small_album_cover_px = self._config['display']['small_album_cover_px']
         display_width = self._config['display']['width']
-        small_album_cover_image = image.resize((small_album_cover_px, small_album_cover_px), Image.LANCZOS)
-        image.paste(small_album_cover_image, ((display_width - small_album_cover_px) // 2, offset_px_top))
+        small_album_cover_image = image.resize((small_album_cover_px, small_album_cover_px), Image.LANCZOS,
+                                               box=crop_box)
+        background_image.paste(small_album_cover_image, ((display_width - small_album_cover_px) // 2, offset_px_top))
 
     def _add_text(self, image: Image, title: str, subtitle: str) -> None:
         subtitle_font = ImageFont.truetype(self._config['display']['font_path'],
@@ -107,6 +135,9 @@ class DisplayService:
 
     def _show_image_on_display(self, image: Image, saturation: float = 0.5) -> None:
         try:
+            if self._inky is None:
+                image.save(self._output_path)
+                return
             self._inky.set_image(image, saturation=saturation)
             self._inky.show()
         except Exception as e:
@@ -16,10 +16,14 @@ class MusicDetectionService:
     CLASS_MAP_PATH: Final[str] = 'src/ml-model/yamnet_class_map.csv'
     MODEL_PATH: Final[str] = 'src/ml-model/1.tflite'
     CONFIDENCE_THRESHOLD: Final[float] = 0.2
+    # YAMNet scores 0.975 s patches (0.96 s of 25 ms STFT windows with a 10 ms hop) every 0.48 s
+    PATCH_WINDOW_SAMPLES: Final[int] = 15600
+    PATCH_HOP_SAMPLES: Final[int] = 7680
 
     def __init__(self, audio_duration_in_seconds: int) -> None:
         self._logger: logging.Logger = Logger().get_logger()
         self._audio_duration_in_seconds: int = audio_duration_in_seconds
+        self._input_length: int = 0
 
         self._interpreter: Interpreter = Interpreter(MusicDetectionService.MODEL_PATH)
         self._configure_interpreter()
@@ -34,10 +38,14 @@ class MusicDetectionService:
         self.scores_output_index = self.output_details[0]['index']
 
         # Resize input tensor to match the expected duration
-        input_shape = [self._audio_duration_in_seconds * MusicDetectionService.SAMPLING_RATE]
-        self._interpreter.resize_tensor_input(self.waveform_input_index, input_shape, strict=True)
+        self._resize_input(self._audio_duration_in_seconds * MusicDetectionService.SAMPLING_RATE)
 
+    def _resize_input(self, input_length: int) -> None:
+        if input_length == self._input_length:
+            return
+        self._interpreter.resize_tensor_input(self.waveform_input_index, [input_length], strict=True)
         self._interpreter.allocate_tensors()
+        self._input_length = input_length
 
     def _load_class_names(self) -> List[str]:
         try:
@@ -59,11 +67,51 @@ class MusicDetectionService:
             self._logger.error("Class names are not loaded. Cannot perform detection.")
             return False
 
+        self._resize_input(len(waveform))
         self._interpreter.set_tensor(self.waveform_input_index, waveform)
         self._interpreter.invoke()
 
         scores = self._interpreter.get_tensor(self.scores_output_index)
 
+        return self._is_music(scores)
+
+    def are_music_detected(self, waveforms: List[np.ndarray]) -> List[bool]:
+        if len(waveforms) == 1:
+            return [self.is_music_detected(waveforms[0])]
+        if not self._class_names:
+            self._logger.error("Class names are not loaded. Cannot perform detection.")
+            return [False] * len(waveforms)
+
+        # The waveforms are laid out back to back without padding, so that a single invocation scores all of them.
+        # Only the patches that lie within one waveform are kept, the ones straddling two waveforms are discarded.
+        hop = MusicDetectionService.PATCH_HOP_SAMPLES
+        batch = np.concatenate(waveforms).astype(np.float32)
+
+        self._resize_input(len(batch))
+        self._interpreter.set_tensor(self.waveform_input_index, batch)
+        self._interpreter.invoke()
+
+        scores = self._interpreter.get_tensor(self.scores_output_index)
+
+        results = []
+        start = 0
+        for waveform in waveforms:
+            end = start + len(waveform)
+            first_patch = -(-start // hop)  # The first patch starting within the waveform
+            last_patch = (end - MusicDetectionService.PATCH_WINDOW_SAMPLES) // hop
+            waveform_scores = scores[first_patch:min(last_patch, len(scores) - 1) + 1]
+            results.append(self._is_music(waveform_scores) if len(waveform_scores) else False)
+            start = end
+        return results
+
+    @staticmethod
+    def count_patches(samples: int) -> int:
+        # Number of patches YAMNet scores for a waveform of this length, its CPU cost grows linearly with it
+        if samples < MusicDetectionService.PATCH_WINDOW_SAMPLES:
+            return 1
+        return 1 + (samples - MusicDetectionService.PATCH_WINDOW_SAMPLES) // MusicDetectionService.PATCH_HOP_SAMPLES
+
+    def _is_music(self, scores: np.ndarray) -> bool:
         top_class, confidence = self._get_top_class(scores)
 
         if top_class == 'Music' and confidence > MusicDetectionService.CONFIDENCE_THRESHOLD:
@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import logging
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import yaml
+
+from logger import Logger
+from config import Config
+from lazy_service import LazyService
+from room_controller import RoomController
+from room import Room
+from state_manager import StateManager, StatePolicy, DisplayState
+from detection_trace import DetectionTrace, DetectionTraceEvent
+from service.weather_service import WeatherInfo
+from service.song_identify_service import SongInfo
+
+
+class SimulatedClock:
+    def __init__(self, start: datetime.datetime) -> None:
+        self._now: datetime.datetime = start
+
+    def now(self) -> datetime.datetime:
+        return self._now
+
+    def set(self, now: datetime.datetime) -> None:
+        self._now = now
+
+
+class _SimulatedDisplayService:
+    def __init__(self) -> None:
+        self.refreshes: int = 0
+        self.cleans: int = 0
+
+    def clean_display(self) -> None:
+        self.cleans += 1
+
+    def update_display_to_playing(self, _song_info: SongInfo) -> None:
+        self.refreshes += 1
+
+    def update_display_to_screensaver(self, _weather_info: WeatherInfo) -> None:
+        self.refreshes += 1
+
+
+class _SimulatedWeatherService:
+    def __init__(self, clock: SimulatedClock) -> None:
+        self._clock: SimulatedClock = clock
+        self.calls: int = 0
+
+    def get_weather_info(self) -> WeatherInfo:
+        self.calls += 1
+        return WeatherInfo(temperature="20°C", sub_description="Simulated weather.", fetched_at=self._clock.now())
+
+
+class _SimulatedSongIdentifyService:
+    def __init__(self) -> None:
+        self.calls: int = 0
+
+    def identify(self, event: DetectionTraceEvent) -> Optional[SongInfo]:
+        self.calls += 1
+        if not event.song_title:
+            return None
+        return SongInfo(title=event.song_title, artist=event.song_artist, album=None, album_art=None)
+
+
+# Runs the same per-room decision logic as NowPlaying against simulated services and a simulated clock, without any
+# hardware
+class SimulatedNowPlaying:
+    def __init__(self, policy: StatePolicy, clock: SimulatedClock) -> None:
+        self.display_service: _SimulatedDisplayService = _SimulatedDisplayService()
+        self.weather_service: _SimulatedWeatherService = _SimulatedWeatherService(clock)
+        self.song_identify_service: _SimulatedSongIdentifyService = _SimulatedSongIdentifyService()
+        self._room: Room = Room(
+            name='simulated',
+            input_device='',
+            display='',
+            state_manager=StateManager(policy, clock=clock.now),
+            display_service=LazyService('DisplayService', lambda: self.display_service)
+        )
+        # Trace events stand in for recordings, the simulated song identify service reads the song from them
+        self._room_controller: RoomController = RoomController(
+            song_identify_service=LazyService('SongIdentifyService', lambda: self.song_identify_service),
+            weather_service=LazyService('WeatherService', lambda: self.weather_service),
+            clock=clock.now
+        )
+
+        self._room_controller.clean_display_and_set_clean_state(self._room)
+
+    def process(self, event: DetectionTraceEvent) -> None:
+        if event.music_detected:
+            self._room_controller.handle_music_detected(self._room, event)
+        else:
+            self._room_controller.handle_no_music_detected(self._room)
+
+    def get_state_manager(self) -> StateManager:
+        return self._room.state_manager
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    name: str
+    simulated_hours: float
+    wall_seconds: float
+    panel_refreshes: int
+    cleans: int
+    song_identify_calls: int
+    weather_calls: int
+    staleness_seconds: List[float]
+
+    def per_hour(self, count: int) -> float:
+        return count / self.simulated_hours if self.simulated_hours > 0 else 0.0
+
+    def staleness_percentile(self, percentile: int) -> float:
+        if not self.staleness_seconds:
+            return 0.0
+        if len(self.staleness_seconds) == 1:
+            return self.staleness_seconds[0]
+        return statistics.quantiles(self.staleness_seconds, n=100, method='inclusive')[percentile - 1]
+
+
+class Simulator:
+    def __init__(self, events: List[DetectionTraceEvent]) -> None:
+        if not events:
+            raise ValueError("Cannot simulate an empty trace.")
+        self._events: List[DetectionTraceEvent] = events
+
+    def run(self, name: str, policy: StatePolicy) -> SimulationResult:
+        started_at = time.perf_counter()
+        clock = SimulatedClock(self._events[0].timestamp)
+        now_playing = SimulatedNowPlaying(policy, clock)
+
+        # The display is stale from the moment it stops matching what is actually playing until it catches up
+        expected_song_title: Optional[str] = None
+        stale_since: Optional[datetime.datetime] = None
+        staleness_seconds = []
+        for event in self._events:
+            clock.set(event.timestamp)
+            now_playing.process(event)
+
+            if not event.music_detected:
+                expected_song_title = None
+            elif event.song_title:
+                expected_song_title = event.song_title
+
+            up_to_date = Simulator._display_matches(now_playing.get_state_manager(), expected_song_title)
+            if not up_to_date and stale_since is None:
+                stale_since = event.timestamp
+            elif up_to_date and stale_since is not None:
+                staleness_seconds.append((event.timestamp - stale_since).total_seconds())
+                stale_since = None
+
+        if stale_since is not None:
+            staleness_seconds.append((self._events[-1].timestamp - stale_since).total_seconds())
+
+        return SimulationResult(
+            name=name,
+            simulated_hours=(self._events[-1].timestamp - self._events[0].timestamp).total_seconds() / 3600,
+            wall_seconds=time.perf_counter() - started_at,
+            panel_refreshes=now_playing.display_service.refreshes,
+            cleans=now_playing.display_service.cleans,
+            song_identify_calls=now_playing.song_identify_service.calls,
+            weather_calls=now_playing.weather_service.calls,
+            staleness_seconds=staleness_seconds
+        )
+
+    @staticmethod
+    def _display_matches(state_manager: StateManager, expected_song_title: Optional[str]) -> bool:
+        state = state_manager.get_state()
+        if expected_song_title is None:
+            return state.current == DisplayState.SCREENSAVER
+        return state.current == DisplayState.PLAYING and state.data.song_title == expected_song_title
+
+    @staticmethod
+    def format_result(result: SimulationResult) -> str:
+        speedup = result.simulated_hours * 3600 / result.wall_seconds if result.wall_seconds > 0 else float('inf')
+        return '\n'.join([
+            f"{result.name}: {result.simulated_hours:.1f} simulated hours in {result.wall_seconds:.2f}s "
+            f"({speedup:,.0f}x real time)",
+            f"  panel refreshes: {result.panel_refreshes} ({result.per_hour(result.panel_refreshes):.2f}/h), "
+            f"cleans: {result.cleans} ({result.per_hour(result.cleans):.2f}/h)",
+            f"  API calls/h: song identify {result.per_hour(result.song_identify_calls):.1f}, "
+            f"weather {result.per_hour(result.weather_calls):.2f}",
+            f"  display staleness over {len(result.staleness_seconds)} episodes: "
+            f"p50 {result.staleness_percentile(50):.0f}s, p90 {result.staleness_percentile(90):.0f}s, "
+            f"p99 {result.staleness_percentile(99):.0f}s, max {max(result.staleness_seconds, default=0):.0f}s"
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays a recorded detection trace through the state and display decision logic.")
+    parser.add_argument('trace', help="detection trace recorded via trace.trace_file_path in config.yaml")
+    parser.add_argument('--policies',
+                        help="YAML file with a list of policies to compare, each with a 'name' and any of "
+                             "no_music_timeout_minutes, weather_refresh_minutes and clean_after_images "
+                             "(default: the state section of config.yaml)")
+    parser.add_argument('--room', help="only replay the events of this room, by default every room is replayed and reported")
+    parser.add_argument('--verbose', action='store_true', help="log every state change")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        Logger().get_logger().setLevel(logging.WARNING)
+
+    if args.policies:
+        with open(args.policies, 'r') as policies_file:
+            policies = [(policy.pop('name'), StatePolicy(**policy)) for policy in yaml.safe_load(policies_file)]
+    else:
+        policies = [('configured', StatePolicy.from_config(Config().get_config()))]
+
+    # Rooms are independent, so the events of every room are replayed on their own
+    events_per_room: Dict[Optional[str], List[DetectionTraceEvent]] = {}
+    for trace_event in DetectionTrace.load(args.trace):
+        if not args.room or trace_event.room == args.room:
+            events_per_room.setdefault(trace_event.room, []).append(trace_event)
+    if not events_per_room:
+        parser.error(f"No events for room '{args.room}' in {args.trace}.")
+
+    for room_name, room_events in events_per_room.items():
+        simulator = Simulator(room_events)
+        for policy_name, state_policy in policies:
+            result_name = f"{policy_name} [{room_name}]" if len(events_per_room) > 1 else policy_name
+            print(Simulator.format_result(simulator.run(result_name, state_policy)))
@@ -0,0 +1,130 @@
+import importlib.abc
+import importlib.machinery
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class _TimingLoader(importlib.abc.Loader):
+    def __init__(self, loader: importlib.abc.Loader, profiler: 'StartupProfiler') -> None:
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec: importlib.machinery.ModuleSpec):
+        with self._profiler.measure_import(spec.name):
+            return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        with self._profiler.measure_import(module.__name__):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, item: str):
+        return getattr(self._loader, item)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, profiler: 'StartupProfiler') -> None:
+        self._profiler = profiler
+
+    def find_spec(self, fullname: str, path, target=None) -> Optional[importlib.machinery.ModuleSpec]:
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimingLoader(spec.loader, self._profiler)
+            return spec
+        return None
+
+
+# Records the import cost of every module and the initialisation cost of every service during startup.
+# Import times are self times: the time spent in nested imports is attributed to the nested module.
+class StartupProfiler:
+    def __init__(self) -> None:
+        self._started_at: float = time.perf_counter()
+        self._import_self_times: Dict[str, float] = defaultdict(float)
+        self._init_times: Dict[str, Tuple[float, str]] = {}
+        self._deferred: List[str] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._local: threading.local = threading.local()
+        self._finder: _TimingFinder = _TimingFinder(self)
+
+    def install(self) -> None:
+        if self._finder not in sys.meta_path:
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self) -> None:
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    @contextmanager
+    def measure_import(self, module_name: str) -> Iterator[None]:
+        # Each frame on the stack accumulates the time spent in its nested imports
+        stack = self._import_stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self._import_self_times[module_name] += elapsed - nested
+
+    @contextmanager
+    def measure_init(self, service_name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._init_times[service_name] = (elapsed, threading.current_thread().name)
+
+    def mark_deferred(self, service_name: str) -> None:
+        with self._lock:
+            self._deferred.append(service_name)
+
+    def report(self, top: int = 15) -> str:
+        with self._lock:
+            import_times = dict(self._import_self_times)
+            init_times = dict(self._init_times)
+            deferred = [name for name in self._deferred if name not in init_times]
+
+        package_times: Dict[str, float] = defaultdict(float)
+        package_module_counts: Dict[str, int] = defaultdict(int)
+        for module_name, self_time in import_times.items():
+            package = module_name.split('.')[0]
+            package_times[package] += self_time
+            package_module_counts[package] += 1
+
+        lines = [f"Startup profile ({time.perf_counter() - self._started_at:.2f}s since profiling started)",
+                 f"Imports by top-level package, self time ({sum(import_times.values()):.2f}s in "
+                 f"{len(import_times)} modules):"]
+        for package, self_time in sorted(package_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"  {package:<32} {self_time:8.3f}s  ({package_module_counts[package]} modules)")
+
+        lines.append("Slowest individual modules, self time:")
+        for module_name, self_time in sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"  {module_name:<32} {self_time:8.3f}s")
+
+        lines.append("Service initialisation, including the imports it triggered:")
+        for service_name, (elapsed, thread_name) in sorted(init_times.items(), key=lambda item: item[1][0],
+                                                           reverse=True):
+            lines.append(f"  {service_name:<32} {elapsed:8.3f}s  [{thread_name}]")
+        for service_name in deferred:
+            lines.append(f"  {service_name:<32} {'deferred':>9}")
+
+        return '\n'.join(lines)
+
+    def _import_stack(self) -> List[float]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
@@ -1,12 +1,14 @@
 import datetime
 import logging
 from enum import Enum
-from typing import Optional
+from typing import Callable, Optional, TYPE_CHECKING
 from dataclasses import dataclass
-from service.weather_service import WeatherInfo
 
 from logger import Logger
 
+if TYPE_CHECKING:
+    from service.weather_service import WeatherInfo
+
 
 class DisplayState(Enum):
     CLEAN = 0
@@ -27,7 +29,7 @@ class PlayingState(StateData):
 
 @dataclass(frozen=True)
 class ScreensaverState(StateData):
-    weather_info: Optional[WeatherInfo] = None
+    weather_info: Optional['WeatherInfo'] = None
 
 
 @dataclass(frozen=True)
@@ -36,15 +38,35 @@ class AppState:
     data: Optional[StateData] = None
 
 
+@dataclass(frozen=True)
+class StatePolicy:
+    no_music_timeout_minutes: float = 1
+    weather_refresh_minutes: float = 60
+    clean_after_images: int = 20
+
+    @staticmethod
+    def from_config(config: dict) -> 'StatePolicy':
+        return StatePolicy(**config.get('state', {}))
+
+
 class StateManager:
-    def __init__(self):
+    def __init__(self, policy: StatePolicy = StatePolicy(),
+                 clock: Callable[[], datetime.datetime] = datetime.datetime.now) -> None:
         self._logger: logging.Logger = Logger().get_logger()
+        self._policy: StatePolicy = policy
+        self._clock: Callable[[], datetime.datetime] = clock
         self._state: AppState = AppState()
         self._last_music_detected_time: Optional[datetime.datetime] = None
+        self._screensaver_since: Optional[datetime.datetime] = None
         self._image_counter: int = 0
 
     def _set_state(self, new_state: DisplayState, data: Optional[StateData]) -> None:
         old_state = self._state.current
+        # Cleaning the display in between does not end a screensaver period
+        if new_state == DisplayState.SCREENSAVER and self._screensaver_since is None:
+            self._screensaver_since = self._clock()
+        elif new_state not in (DisplayState.SCREENSAVER, DisplayState.CLEAN):
+            self._screensaver_since = None
         self._state = AppState(
             current=new_state,
             data=data
@@ -58,28 +80,28 @@ class StateManager:
         playing_state = PlayingState(song_title=song_title, song_artist=song_artist)
         self._set_state(DisplayState.PLAYING, playing_state)
 
-    def set_screensaver_state(self, weather_info: WeatherInfo) -> None:
+    def set_screensaver_state(self, weather_info: 'WeatherInfo') -> None:
         screensaver_state = ScreensaverState(weather_info=weather_info)
         self._set_state(DisplayState.SCREENSAVER, screensaver_state)
 
     def update_last_music_detected_time(self) -> None:
-        self._last_music_detected_time = datetime.datetime.now()
+        self._last_music_detected_time = self._clock()
 
     def increase_image_counter(self) -> None:
         self._image_counter += 1
 
     def should_clean_display(self) -> bool:
-        if self._image_counter > 20:
+        if self._image_counter > self._policy.clean_after_images:
             self._logger.debug("Display should be cleaned to avoid 'ghosting' from previous images.")
             self._image_counter = 0
             return True
 
-    def no_music_detected_for_more_than_a_minute(self) -> bool:
+    def no_music_detected_for_too_long(self) -> bool:
         if self._last_music_detected_time is None:
             return True
-        elapsed_time = datetime.datetime.now() - self._last_music_detected_time
-        if elapsed_time >= datetime.timedelta(minutes=1):
-            self._logger.info("No music detected for more than a minute.")
+        elapsed_time = self._clock() - self._last_music_detected_time
+        if elapsed_time >= datetime.timedelta(minutes=self._policy.no_music_timeout_minutes):
+            self._logger.info(f"No music detected for more than {self._policy.no_music_timeout_minutes:g} minute(s).")
             return True
         return False
 
@@ -95,14 +117,19 @@ class StateManager:
     def screensaver_still_up_but_weather_info_outdated(self) -> bool:
         if self._state.current != DisplayState.SCREENSAVER:
             return False
-        elapsed_time = datetime.datetime.now() - self._get_screensaver_state().weather_info.fetched_at
-        if elapsed_time >= datetime.timedelta(minutes=60):
+        elapsed_time = self._clock() - self._get_screensaver_state().weather_info.fetched_at
+        if elapsed_time >= datetime.timedelta(minutes=self._policy.weather_refresh_minutes):
             self._logger.info("Weather info outdated.")
             return True
 
     def get_state(self) -> AppState:
         return self._state
 
+    def get_time_in_screensaver(self) -> datetime.timedelta:
+        if self._state.current != DisplayState.SCREENSAVER or self._screensaver_since is None:
+            return datetime.timedelta(0)
+        return self._clock() - self._screensaver_since
+
     def get_playing_state(self) -> PlayingState:
         if self._state.current == DisplayState.PLAYING and isinstance(self._state.data, PlayingState):
             return self._state.data
@@ -0,0 +1,34 @@
+import logging
+import os
+import socket
+from typing import Optional
+
+from logger import Logger
+
+
+# Minimal sd_notify(3) client, so that no libsystemd bindings are needed. Messages are silently dropped when the
+# process is not started by systemd.
+class SystemdNotifier:
+    def __init__(self) -> None:
+        self._logger: logging.Logger = Logger().get_logger()
+        self._address: Optional[str] = os.environ.get('NOTIFY_SOCKET')
+        if self._address and self._address.startswith('@'):
+            self._address = '\0' + self._address[1:]  # Abstract namespace socket
+
+    def get_watchdog_interval_seconds(self) -> Optional[float]:
+        # Set by systemd when the unit has WatchdogSec, pings are expected at least this often
+        watchdog_usec = os.environ.get('WATCHDOG_USEC')
+        watchdog_pid = os.environ.get('WATCHDOG_PID')
+        if not watchdog_usec or (watchdog_pid and int(watchdog_pid) != os.getpid()):
+            return None
+        return int(watchdog_usec) / 1_000_000
+
+    def notify(self, message: str) -> None:
+        if not self._address:
+            return
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify_socket:
+                notify_socket.connect(self._address)
+                notify_socket.sendall(message.encode())
+        except OSError as e:
+            self._logger.error(f"Notifying systemd failed: {e}")